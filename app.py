@@ -1,22 +1,44 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
+from flask_sqlalchemy.session import Session as FlaskSession
+from datetime import datetime, timezone, timedelta
 import os
 import uuid
-import boto3
 import time
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import json
-import watchtower
+import json.encoder
+import fnmatch
+import base64
+import hashlib
+import io
+import math
+import mimetypes
+import zlib
+import atexit
+import threading
+import contextvars
+import heapq
+from contextlib import contextmanager
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Epilogue, Data
+from werkzeug.sansio.multipart import File as MultipartFile
 from datetime import date
 from statsd import StatsClient
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import OperationalError, IntegrityError, TimeoutError as SQLAlchemyTimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateIndex
 
 # Custom JSON formatter for logs
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         log_record = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
             "level": record.levelname,
             "message": record.getMessage(),
             "logger": record.name,
@@ -33,11 +55,360 @@ class JsonFormatter(logging.Formatter):
             
         return json.dumps(log_record)
 
-# Initialize StatsClient for metrics
-statsd_client = StatsClient(host='localhost', port=8125, prefix='webapp')
+class FastJsonFormatter(logging.Formatter):
+    # Produces the JsonFormatter fields from a fixed key layout, leaving out empty fields.
+    # The date and time part of the timestamp is formatted once per second.
+    FIELDS = ('path', 'method', 'status_code', 'remote_addr', 'duration_ms', 'operation')
+    _encode = staticmethod(json.encoder.encode_basestring_ascii)
+
+    def __init__(self):
+        super().__init__()
+        self._keys = {field: f', "{field}": ' for field in self.FIELDS}
+        self._cached_second = (None, '')
+
+    def _timestamp(self, created):
+        second = int(created)
+        cached_second, prefix = self._cached_second
+        if second != cached_second:
+            prefix = datetime.fromtimestamp(second, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+            self._cached_second = (second, prefix)
+        return f'{prefix}.{int((created - second) * 1000000):06d}+00:00'
+
+    def format(self, record):
+        encode = self._encode
+        parts = [
+            '{"timestamp": "', self._timestamp(record.created),
+            '", "level": ', encode(record.levelname),
+            ', "message": ', encode(record.getMessage()),
+            ', "logger": ', encode(record.name)
+        ]
+        values = record.__dict__
+        for field in self.FIELDS:
+            value = values.get(field)
+            if value is None or value == '':
+                continue
+            parts.append(self._keys[field])
+            if isinstance(value, str):
+                parts.append(encode(value))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                parts.append(repr(value))
+            else:
+                parts.append(encode(str(value)))
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts.append(', "exception": ')
+            parts.append(encode(record.exc_text))
+
+        parts.append('}')
+        return ''.join(parts)
+
+class LogSampler(logging.Filter):
+    # Thins high-volume records below WARNING; rates map a message or operation (glob patterns
+    # allowed) to the fraction of records kept. WARNING and above always pass.
+    # Messages are usually f-strings with ids interpolated, so pattern lookups are cached in a
+    # bounded LRU and sampling credit is kept per pattern rather than per message.
+    RESOLVED_CACHE_SIZE = 1024
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved = OrderedDict()
+        self._credit = {}
+        self._lock = threading.Lock()
+
+    def _pattern_for(self, key):
+        with self._lock:
+            if key in self._resolved:
+                self._resolved.move_to_end(key)
+                return self._resolved[key]
+
+        if key in self.rates:
+            pattern = key
+        else:
+            pattern = next((p for p in self.rates if fnmatch.fnmatchcase(key, p)), None)
+
+        with self._lock:
+            self._resolved[key] = pattern
+            if len(self._resolved) > self.RESOLVED_CACHE_SIZE:
+                self._resolved.popitem(last=False)
+        return pattern
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+
+        pattern = self._pattern_for(str(record.msg))
+        if pattern is None:
+            operation = getattr(record, 'operation', '')
+            pattern = self._pattern_for(operation) if operation else None
+        if pattern is None:
+            return True
+        rate = self.rates[pattern]
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+
+        # Keep a steady fraction instead of a random one so low rates still emit regularly
+        with self._lock:
+            credit = self._credit.get(pattern, 1.0 - rate) + rate
+            keep = credit >= 1.0
+            self._credit[pattern] = credit - 1.0 if keep else credit
+        return keep
+
+_span_depth = contextvars.ContextVar('span_depth', default=0)
+
+class RequestTrace:
+    # Nested timing spans recorded while serving one request
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.status_code = None
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.handler_start = None
+        self.spans = []
+
+    def add(self, name, depth, start, end):
+        # list.append is atomic, so spans may be added from worker threads
+        self.spans.append((name, depth, (start - self.start) * 1000, (end - start) * 1000))
+
+    def finish(self, status_code):
+        self.status_code = status_code
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        # One Server-Timing entry per span name, summed over repeated spans
+        totals = {}
+        for name, _, _, duration in self.spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + duration)
+        entries = []
+        for name, (count, total) in totals.items():
+            entry = f'{name};dur={total:.2f}'
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f'total;dur={self.duration_ms:.2f}')
+        return ', '.join(entries)
+
+    def to_dict(self):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 3),
+            "spans": [
+                {"name": name, "depth": depth, "start_ms": round(start, 3), "duration_ms": round(duration, 3)}
+                for name, depth, start, duration in sorted(self.spans, key=lambda span: span[2])
+            ]
+        }
+
+class SlowRequestLog:
+    # Keeps the slowest traced requests seen by this process
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def record(self, trace, size):
+        with self._lock:
+            self._counter += 1
+            entry = (trace.duration_ms, self._counter, trace)
+            if len(self._heap) < size:
+                heapq.heappush(self._heap, entry)
+            elif size > 0 and entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self):
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        return [trace.to_dict() for _, _, trace in entries]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+slow_requests = SlowRequestLog()
+
+def current_trace():
+    if has_request_context():
+        return g.get('trace')
+    return None
+
+@contextmanager
+def trace_span(name):
+    # Time a block as a span of the current request's trace; a no-op when tracing is off
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+
+    depth = _span_depth.get()
+    token = _span_depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _span_depth.reset(token)
+        trace.add(name, depth, start, time.perf_counter())
+
+class TracingLogger(logging.Logger):
+    # Records the time spent emitting each log record as a "log" span
+    def handle(self, record):
+        with trace_span('log'):
+            super().handle(record)
+
+class StatsdCounterAggregator:
+    # Pre-sums counters in the process and sends the totals together every interval
+    def __init__(self, client, interval):
+        self.client = client
+        self.interval = interval
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def incr(self, stat, count):
+        with self._lock:
+            self._counts[stat] = self._counts.get(stat, 0) + count
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = run_periodically('statsd_aggregator', self.interval, self.flush)
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if counts:
+            with self.client.pipeline() as pipe:
+                for stat, count in counts.items():
+                    pipe.incr(stat, count)
+
+class BatchingStatsClient:
+    # Wraps a StatsClient so metrics recorded during a request are collected in a pipeline and
+    # sent as packed datagrams when the request ends; outside requests they are sent directly.
+    def __init__(self, client, batching=False, aggregate_interval=0):
+        self.client = client
+        self.batching = batching
+        self.aggregator = StatsdCounterAggregator(client, aggregate_interval) if aggregate_interval > 0 else None
+
+    def _target(self):
+        if self.batching and has_request_context():
+            pipeline = g.get('statsd_pipeline')
+            if pipeline is not None:
+                return pipeline
+        return self.client
+
+    def start_request(self):
+        if self.batching:
+            g.statsd_pipeline = self.client.pipeline()
+
+    def finish_request(self):
+        pipeline = g.pop('statsd_pipeline', None)
+        if pipeline is not None:
+            pipeline.send()
+
+    def flush(self):
+        if self.aggregator is not None:
+            self.aggregator.flush()
+
+    def incr(self, stat, count=1, rate=1):
+        if self.aggregator is not None and rate == 1:
+            self.aggregator.incr(stat, count)
+        else:
+            self._target().incr(stat, count, rate)
+
+    def decr(self, stat, count=1, rate=1):
+        self.incr(stat, -count, rate)
+
+    def timing(self, stat, delta, rate=1):
+        self._target().timing(stat, delta, rate)
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        self._target().gauge(stat, value, rate, delta)
+
+    def set(self, stat, value, rate=1):
+        self._target().set(stat, value, rate)
+
+    def pipeline(self):
+        return self.client.pipeline()
+
+class InstrumentedQueuePool(QueuePool):
+    # QueuePool that reports checkouts, how long each one waited and how much overflow is in use
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except SQLAlchemyTimeoutError:
+            # The pool stayed exhausted for pool_timeout seconds
+            statsd_client.incr('db.pool.checkout_timeout')
+            raise
+        except Exception:
+            # Connect or auth failures while opening a new connection, not pool exhaustion
+            statsd_client.incr('db.pool.checkout_error')
+            raise
+        finally:
+            statsd_client.timing('db.pool.checkout_wait', (time.perf_counter() - start) * 1000)
+        statsd_client.incr('db.pool.checkout')
+        statsd_client.gauge('db.pool.checked_out', self.checkedout())
+        statsd_client.gauge('db.pool.overflow', max(self.overflow(), 0))
+        return connection
+
+@event.listens_for(InstrumentedQueuePool, 'connect')
+def report_pool_connect(dbapi_connection, connection_record):
+    statsd_client.incr('db.pool.connect')
+
+@event.listens_for(InstrumentedQueuePool, 'invalidate')
+def report_pool_invalidate(dbapi_connection, connection_record, exception):
+    statsd_client.incr('db.pool.invalidate')
+
+def database_engine_options(uri):
+    # Pool settings from the environment; SQLite keeps SQLAlchemy's defaults
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        # Recycle connections before RDS/MySQL closes them for being idle
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True') == 'True',
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    }
+
+# Set while a read-only query should be sent to the read replica
+_read_replica = contextvars.ContextVar('read_replica', default=False)
+
+class RoutingSession(FlaskSession):
+    # Sends queries made inside read_db_operation() to the 'replica' bind when one is configured;
+    # flushes and everything else use the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _read_replica.get() and not self._flushing and 'replica' in self._db.engines:
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# Initialize StatsClient for metrics. With STATSD_BATCHING=True each request's metrics are sent
+# together, packed into datagrams of up to STATSD_MAX_UDP_SIZE bytes; STATSD_AGGREGATE_INTERVAL
+# additionally pre-sums counters for that many seconds before sending.
+statsd_client = BatchingStatsClient(
+    StatsClient(
+        host=os.getenv('STATSD_HOST', 'localhost'),
+        port=int(os.getenv('STATSD_PORT', '8125')),
+        prefix='webapp',
+        maxudpsize=int(os.getenv('STATSD_MAX_UDP_SIZE', '1432'))
+    ),
+    batching=os.getenv('STATSD_BATCHING', 'False') == 'True',
+    aggregate_interval=float(os.getenv('STATSD_AGGREGATE_INTERVAL', '0'))
+)
+atexit.register(statsd_client.flush)
 
 app = Flask(__name__)
-if os.getenv('TESTING')=='True':
+if os.getenv('DATABASE_URL'):
+    # Explicit database URL, e.g. a local SQLite file or MySQL instance for load testing
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
+elif os.getenv('TESTING')=='True':
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
 else:
     db_username = os.getenv('DB_USERNAME')
@@ -46,74 +417,750 @@ else:
     db_name = os.getenv('DB_NAME', 'webapp')
     app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql://{db_username}:{db_password}@{db_host}/{db_name}'
 
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Optional read replica for file metadata reads; uploads, deletes and health checks stay on the primary
+replica_uri = os.getenv('DATABASE_REPLICA_URL')
+if not replica_uri and os.getenv('DB_REPLICA_HOST'):
+    replica_uri = (
+        f"mysql://{os.getenv('DB_USERNAME')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_REPLICA_HOST')}/{os.getenv('DB_NAME', 'webapp')}"
+    )
+if replica_uri:
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': replica_uri, **database_engine_options(replica_uri)}}
+# A client's reads stay on the primary for this many seconds after it writes file metadata
+app.config['DB_REPLICA_READ_AFTER_WRITE'] = float(os.getenv('DB_REPLICA_READ_AFTER_WRITE', '5'))
+# Seconds to stop using the replica after it fails
+app.config['DB_REPLICA_RETRY_INTERVAL'] = float(os.getenv('DB_REPLICA_RETRY_INTERVAL', '30'))
+
+# Opt-in caching of health check results; 0 keeps one DB write per probe
+app.config['HEALTH_CHECK_CACHE_TTL'] = float(os.getenv('HEALTH_CHECK_CACHE_TTL', '0'))
+
+# Opt-in write-behind buffering of health check rows, flushed per interval or per N rows
+app.config['HEALTH_CHECK_WRITE_BEHIND'] = os.getenv('HEALTH_CHECK_WRITE_BEHIND', 'False') == 'True'
+app.config['HEALTH_CHECK_FLUSH_INTERVAL'] = float(os.getenv('HEALTH_CHECK_FLUSH_INTERVAL', '5'))
+app.config['HEALTH_CHECK_FLUSH_ROWS'] = int(os.getenv('HEALTH_CHECK_FLUSH_ROWS', '500'))
+
+# Retention for the healthCheck table; 0 keeps every row
+app.config['HEALTH_CHECK_RETENTION_DAYS'] = float(os.getenv('HEALTH_CHECK_RETENTION_DAYS', '0'))
+app.config['HEALTH_CHECK_RETENTION_BATCH_SIZE'] = int(os.getenv('HEALTH_CHECK_RETENTION_BATCH_SIZE', '1000'))
+app.config['HEALTH_CHECK_RETENTION_INTERVAL'] = float(os.getenv('HEALTH_CHECK_RETENTION_INTERVAL', '3600'))
+
+# Opt-in streaming of multipart uploads straight into S3 without spooling to disk
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+app.config['UPLOAD_STREAMING'] = os.getenv('UPLOAD_STREAMING', 'False') == 'True'
+app.config['UPLOAD_PART_SIZE'] = max(int(os.getenv('UPLOAD_PART_SIZE', str(8 * 1024 * 1024))), S3_MIN_PART_SIZE)
+app.config['UPLOAD_PART_CONCURRENCY'] = max(int(os.getenv('UPLOAD_PART_CONCURRENCY', '4')), 1)
+app.config['UPLOAD_READ_CHUNK_SIZE'] = int(os.getenv('UPLOAD_READ_CHUNK_SIZE', str(64 * 1024)))
+
+# Opt-in overlap of the S3 transfer with the metadata insert in upload_file()
+app.config['UPLOAD_OVERLAP_DB_WRITE'] = os.getenv('UPLOAD_OVERLAP_DB_WRITE', 'False') == 'True'
+app.config['UPLOAD_OVERLAP_WORKERS'] = int(os.getenv('UPLOAD_OVERLAP_WORKERS', '8'))
+
+# Opt-in content-addressed deduplication: uploads are hashed and identical content shares one S3 object
+app.config['UPLOAD_DEDUP'] = os.getenv('UPLOAD_DEDUP', 'False') == 'True'
+
+# Presigned direct-to-S3 uploads
+app.config['UPLOAD_PRESIGN_EXPIRES'] = int(os.getenv('UPLOAD_PRESIGN_EXPIRES', '900'))
+app.config['UPLOAD_PRESIGN_MAX_SIZE'] = int(os.getenv('UPLOAD_PRESIGN_MAX_SIZE', str(5 * 1024 ** 3)))
+# Seconds a presigned upload can still be completed, counted from presigning; expired reservations are
+# purged every UPLOAD_RESERVATION_PURGE_INTERVAL seconds
+app.config['UPLOAD_RESERVATION_TTL'] = int(os.getenv('UPLOAD_RESERVATION_TTL', '86400'))
+app.config['UPLOAD_RESERVATION_PURGE_INTERVAL'] = float(os.getenv('UPLOAD_RESERVATION_PURGE_INTERVAL', '3600'))
+
+# Read-through cache of file metadata for GET /v1/file/<id>; 0 entries disables it
+app.config['FILE_CACHE_SIZE'] = int(os.getenv('FILE_CACHE_SIZE', '0'))
+app.config['FILE_CACHE_TTL'] = float(os.getenv('FILE_CACHE_TTL', '300'))
+app.config['FILE_CACHE_NEGATIVE_TTL'] = float(os.getenv('FILE_CACHE_NEGATIVE_TTL', '5'))
+
+# Opt-in gzip compression of uploads. A file is compressed when its content type matches one of
+# UPLOAD_COMPRESS_TYPES, or when the Shannon entropy of its first UPLOAD_COMPRESS_SAMPLE_SIZE bytes is
+# at most UPLOAD_COMPRESS_MAX_ENTROPY bits per byte (text is around 4-5, compressed data close to 8).
+# Files known to be smaller than UPLOAD_COMPRESS_MIN_SIZE are stored as received.
+app.config['UPLOAD_COMPRESSION'] = os.getenv('UPLOAD_COMPRESSION', 'False') == 'True'
+app.config['UPLOAD_COMPRESS_TYPES'] = [
+    pattern.strip() for pattern in os.getenv(
+        'UPLOAD_COMPRESS_TYPES',
+        'text/*,application/json,application/*+json,application/x-ndjson,application/xml,'
+        'application/*+xml,application/javascript,application/csv,application/yaml,application/x-yaml'
+    ).split(',') if pattern.strip()
+]
+app.config['UPLOAD_COMPRESS_MAX_ENTROPY'] = float(os.getenv('UPLOAD_COMPRESS_MAX_ENTROPY', '6.0'))
+app.config['UPLOAD_COMPRESS_SAMPLE_SIZE'] = int(os.getenv('UPLOAD_COMPRESS_SAMPLE_SIZE', str(64 * 1024)))
+app.config['UPLOAD_COMPRESS_MIN_SIZE'] = int(os.getenv('UPLOAD_COMPRESS_MIN_SIZE', '1024'))
+app.config['UPLOAD_COMPRESS_LEVEL'] = int(os.getenv('UPLOAD_COMPRESS_LEVEL', '1'))
+
+# Bytes read from S3 per chunk when streaming file content to the client
+app.config['DOWNLOAD_CHUNK_SIZE'] = int(os.getenv('DOWNLOAD_CHUNK_SIZE', str(64 * 1024)))
+
+# HTTP caching of successful responses per endpoint. By default file metadata and content are sent with
+# no-cache, so every use is revalidated and a deleted file stops being served at once. HTTP_CACHE_MAX_AGE
+# lets the client's own cache reuse them for that many seconds; shared caches and CDNs may only store
+# them when HTTP_CACHE_PUBLIC is also set, and then keep serving a deleted file until max-age expires.
+# Endpoints in CACHE_ETAG_ENDPOINTS get a strong ETag and answer If-None-Match with 304. Endpoints not
+# listed keep the no-store headers set by their handlers.
+app.config['HTTP_CACHE_MAX_AGE'] = int(os.getenv('HTTP_CACHE_MAX_AGE', '0'))
+app.config['HTTP_CACHE_PUBLIC'] = os.getenv('HTTP_CACHE_PUBLIC', 'False') == 'True'
+
+def file_cache_control(max_age, public):
+    if max_age <= 0:
+        return 'no-cache'
+    return f"{'public' if public else 'private'}, max-age={max_age}"
+
+app.config['CACHE_POLICIES'] = {
+    'health_check': 'no-cache, no-store, must-revalidate',
+    'cicd': 'no-cache, no-store, must-revalidate',
+    'get_file': file_cache_control(app.config['HTTP_CACHE_MAX_AGE'], app.config['HTTP_CACHE_PUBLIC']),
+    'download_file': file_cache_control(app.config['HTTP_CACHE_MAX_AGE'], app.config['HTTP_CACHE_PUBLIC']),
+    'list_files': 'no-cache'
+}
+app.config['CACHE_ETAG_ENDPOINTS'] = {'get_file', 'list_files'}
+
+# Maximum ids accepted by the batch metadata lookup
+app.config['FILE_BATCH_MAX_IDS'] = int(os.getenv('FILE_BATCH_MAX_IDS', '100'))
+
+# Bulk delete limits; S3 DeleteObjects accepts at most 1000 keys per call
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+app.config['FILE_BULK_DELETE_MAX_IDS'] = int(os.getenv('FILE_BULK_DELETE_MAX_IDS', '10000'))
+
+# Asynchronous deletes only tombstone the file row; a background reaper in each worker later removes
+# the S3 objects and rows in batches, backing off up to FILE_REAPER_MAX_BACKOFF seconds while S3 fails
+app.config['FILE_DELETE_ASYNC'] = os.getenv('FILE_DELETE_ASYNC', 'False') == 'True'
+app.config['FILE_REAPER_INTERVAL'] = float(os.getenv('FILE_REAPER_INTERVAL', '10'))
+app.config['FILE_REAPER_BATCH_SIZE'] = int(os.getenv('FILE_REAPER_BATCH_SIZE', '500'))
+app.config['FILE_REAPER_MAX_BACKOFF'] = float(os.getenv('FILE_REAPER_MAX_BACKOFF', '300'))
+# Seconds a reaper holds the batch it claimed; a batch left by a crashed worker is reaped after that
+app.config['FILE_REAPER_LEASE'] = float(os.getenv('FILE_REAPER_LEASE', '300'))
+
+# Page sizes for the keyset-paginated file listing
+app.config['FILE_LIST_DEFAULT_LIMIT'] = int(os.getenv('FILE_LIST_DEFAULT_LIMIT', '100'))
+app.config['FILE_LIST_MAX_LIMIT'] = int(os.getenv('FILE_LIST_MAX_LIMIT', '1000'))
+
+# Admission control: per-worker caps on concurrent requests for each endpoint group (0 = unlimited).
+# Up to ADMISSION_QUEUE_SIZE more requests per group wait at most ADMISSION_QUEUE_TIMEOUT seconds for
+# a slot; beyond that requests are shed with 503 and Retry-After. Endpoints without a group, such as
+# the health checks, are never limited, so keep the upload limit below GUNICORN_THREADS to leave
+# threads free for them.
+app.config['ADMISSION_GROUPS'] = {
+    'upload_file': 'upload',
+    'presign_upload': 'upload',
+    'complete_upload': 'upload',
+    'delete_file': 'delete',
+    'bulk_delete_files': 'delete',
+    'get_file': 'read',
+    'download_file': 'read',
+    'lookup_files': 'read',
+    'list_files': 'read'
+}
+app.config['ADMISSION_LIMITS'] = {
+    'upload': int(os.getenv('ADMISSION_UPLOAD_LIMIT', '0')),
+    'delete': int(os.getenv('ADMISSION_DELETE_LIMIT', '0')),
+    'read': int(os.getenv('ADMISSION_READ_LIMIT', '0'))
+}
+app.config['ADMISSION_QUEUE_SIZE'] = int(os.getenv('ADMISSION_QUEUE_SIZE', '2'))
+app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '0.5'))
+app.config['ADMISSION_RETRY_AFTER'] = int(os.getenv('ADMISSION_RETRY_AFTER', '1'))
+
+# Connection pool, retry and timeout settings for the shared S3 client
+app.config['S3_MAX_POOL_CONNECTIONS'] = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '50'))
+app.config['S3_MAX_ATTEMPTS'] = int(os.getenv('S3_MAX_ATTEMPTS', '3'))
+app.config['S3_RETRY_MODE'] = os.getenv('S3_RETRY_MODE', 'standard')
+app.config['S3_CONNECT_TIMEOUT'] = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+app.config['S3_READ_TIMEOUT'] = float(os.getenv('S3_READ_TIMEOUT', '60'))
+app.config['S3_STATS_INTERVAL'] = float(os.getenv('S3_STATS_INTERVAL', '60'))
+# Point the client at a local S3 stand-in such as MinIO
+app.config['S3_ENDPOINT_URL'] = os.getenv('S3_ENDPOINT_URL') or None
+
+# Opt-in queued logging; request threads enqueue and a background listener formats and ships
+app.config['LOG_QUEUE_ENABLED'] = os.getenv('LOG_QUEUE_ENABLED', 'False') == 'True'
+app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+app.config['LOG_QUEUE_OVERFLOW'] = os.getenv('LOG_QUEUE_OVERFLOW', 'drop')
+app.config['LOG_QUEUE_BLOCK_TIMEOUT'] = float(os.getenv('LOG_QUEUE_BLOCK_TIMEOUT', '1'))
+app.config['LOG_QUEUE_SAMPLE_RATE'] = int(os.getenv('LOG_QUEUE_SAMPLE_RATE', '10'))
+app.config['LOG_QUEUE_STATS_INTERVAL'] = float(os.getenv('LOG_QUEUE_STATS_INTERVAL', '10'))
+
+# Per-request span tracing returned in a Server-Timing header; the slowest requests are kept
+# in memory and can be read from /debug/slow-requests when TRACE_DEBUG_ENDPOINT is enabled
+app.config['REQUEST_TRACING'] = os.getenv('REQUEST_TRACING', 'False') == 'True'
+app.config['TRACE_SLOW_REQUESTS'] = int(os.getenv('TRACE_SLOW_REQUESTS', '50'))
+app.config['TRACE_DEBUG_ENDPOINT'] = os.getenv('TRACE_DEBUG_ENDPOINT', 'False') == 'True'
+
+# Application log file, and how many records are held for CloudWatch until warm_up() attaches it
+app.config['LOG_FILE'] = os.getenv('LOG_FILE', '/var/log/csye6225.log')
+app.config['LOG_DEFERRED_CAPACITY'] = int(os.getenv('LOG_DEFERRED_CAPACITY', '10000'))
+
+# Seconds between retries of warm-up steps that failed; /readyz reports 503 until they succeed
+app.config['WARM_UP_RETRY_INTERVAL'] = float(os.getenv('WARM_UP_RETRY_INTERVAL', '5'))
+
+# Log formatter ('json' or 'fast') and per-message/operation sampling rates, e.g.
+# LOG_SAMPLE_RATES='{"Database operation get_file completed": 0.1, "s3.*": 0.5}'
+app.config['LOG_FORMAT'] = os.getenv('LOG_FORMAT', 'json')
+app.config['LOG_SAMPLE_RATES'] = json.loads(os.getenv('LOG_SAMPLE_RATES') or '{}')
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 
 # Configure CloudWatch logging
 log_group = os.getenv('CLOUDWATCH_LOG_GROUP', 'webapp-logs')
 log_stream = os.getenv('CLOUDWATCH_LOG_STREAM', 'app-logs')
 
 # Set up logging
+logger_class = logging.getLoggerClass()
+logging.setLoggerClass(TracingLogger)
 logger = logging.getLogger('webapp')
+logging.setLoggerClass(logger_class)
 logger.setLevel(logging.INFO)
-json_formatter = JsonFormatter()
+json_formatter = FastJsonFormatter() if app.config['LOG_FORMAT'] == 'fast' else JsonFormatter()
+if app.config['LOG_SAMPLE_RATES']:
+    logger.addFilter(LogSampler(app.config['LOG_SAMPLE_RATES']))
+
+class DeferredHandler(logging.Handler):
+    # Stands in for a handler that is slow to build. Records are buffered, oldest dropped first,
+    # until set_target() replays them to the real handler and forwards everything after that.
+    def __init__(self, capacity):
+        super().__init__()
+        self.target = None
+        self.buffer = deque(maxlen=capacity)
+
+    def emit(self, record):
+        if self.target is not None:
+            self.target.handle(record)
+            return
+        record.msg = record.getMessage()
+        record.args = None
+        self.buffer.append(record)
+
+    def set_target(self, target):
+        self.acquire()
+        try:
+            self.target = target
+            while self.buffer:
+                target.handle(self.buffer.popleft())
+        finally:
+            self.release()
+
+    def flush(self):
+        if self.target is not None:
+            self.target.flush()
+
+def create_cloudwatch_handler():
+    # Imported here because boto3 and watchtower are slow to import, and building the handler
+    # makes AWS calls to create the log group
+    import watchtower
+    handler = watchtower.CloudWatchLogHandler(
+        log_group=log_group,
+        stream_name=log_stream,
+        create_log_group=True
+    )
+    handler.setFormatter(json_formatter)
+    return handler
 
-# Add CloudWatch handler
+# Collect the handlers that ship application logs
+log_handlers = []
+cloudwatch_handler = None
 if not os.getenv('TESTING') == 'True':
+    # CloudWatch is attached by warm_up() in each serving process; records wait here until then
+    cloudwatch_handler = DeferredHandler(app.config['LOG_DEFERRED_CAPACITY'])
+    log_handlers.append(cloudwatch_handler)
+    # Records from before a fork were already written locally by the parent; don't replay them
+    os.register_at_fork(after_in_child=cloudwatch_handler.buffer.clear)
+    
     try:
-        # Create CloudWatch handler with JSON formatter
-        cloudwatch_handler = watchtower.CloudWatchLogHandler(
-            log_group=log_group,
-            stream_name=log_stream,
-            create_log_group=True
-        )
-        cloudwatch_handler.setFormatter(json_formatter)
-        logger.addHandler(cloudwatch_handler)
-        
         # Also add file handler for application logs
-        app_file_handler = logging.FileHandler('/var/log/csye6225.log')
+        app_file_handler = logging.FileHandler(app.config['LOG_FILE'])
         app_file_handler.setFormatter(json_formatter)
-        logger.addHandler(app_file_handler)
-        
-        # Also add console handler for local debugging
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(json_formatter)
-        logger.addHandler(console_handler)
-        
-        extra = {'path': '', 'method': '', 'remote_addr': ''}
-        logger.info("CloudWatch logging initialized successfully", extra=extra)
+        log_handlers.append(app_file_handler)
     except Exception as e:
-        print(f"Failed to initialize CloudWatch logging: {e}")
-        # Fallback to console logging
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(json_formatter)
-        logger.addHandler(console_handler)
+        print(f"Failed to open log file {app.config['LOG_FILE']}: {e}")
+    
+    # Also add console handler for local debugging
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(json_formatter)
+    log_handlers.append(console_handler)
+
+
+class BoundedQueueHandler(QueueHandler):
+    # Puts records on a bounded in-memory queue so request threads never format or ship logs.
+    # overflow decides what happens when the queue is full:
+    #   drop   - discard the record
+    #   block  - wait up to block_timeout for space, then discard
+    #   sample - past half full keep every Nth record below WARNING; WARNING and above wait like block
+    def __init__(self, log_queue, overflow='drop', block_timeout=1.0, sample_rate=10):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.sample_rate = max(sample_rate, 1)
+        self.dropped = 0
+        self._sampled = 0
+        self._counter_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The listener runs in this process, so formatting is left to it; only the message
+        # arguments are merged now in case they are mutated after the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def _count_drop(self):
+        with self._counter_lock:
+            self.dropped += 1
+
+    def enqueue(self, record):
+        important = record.levelno >= logging.WARNING
+        if self.overflow == 'sample' and not important and self.queue.qsize() >= self.queue.maxsize // 2:
+            with self._counter_lock:
+                self._sampled += 1
+                keep = self._sampled % self.sample_rate == 0
+            if not keep:
+                self._count_drop()
+                return
+
+        try:
+            if self.overflow == 'block' or (self.overflow == 'sample' and important):
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self._count_drop()
+
+log_queue_handler = None
+log_queue_listener = None
+_log_queue_dropped_reported = 0
+
+def start_log_queue():
+    # Route records through a bounded queue drained by a background listener thread
+    global log_queue_handler, log_queue_listener
+    log_queue = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+    if log_queue_handler is None:
+        log_queue_handler = BoundedQueueHandler(
+            log_queue,
+            overflow=app.config['LOG_QUEUE_OVERFLOW'],
+            block_timeout=app.config['LOG_QUEUE_BLOCK_TIMEOUT'],
+            sample_rate=app.config['LOG_QUEUE_SAMPLE_RATE']
+        )
+        logger.addHandler(log_queue_handler)
+    else:
+        # After a fork the old queue's locks and listener thread belong to the parent
+        log_queue_handler.queue = log_queue
+    log_queue_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_queue_listener.start()
+
+def stop_log_queue():
+    # Ship whatever is still queued before the process exits
+    if log_queue_listener is not None:
+        try:
+            log_queue_listener.stop()
+        except Exception:
+            pass
+
+def log_queue_stats():
+    return {
+        'depth': log_queue_handler.queue.qsize() if log_queue_handler else 0,
+        'dropped': log_queue_handler.dropped if log_queue_handler else 0
+    }
+
+def report_log_queue_stats():
+    global _log_queue_dropped_reported
+    stats = log_queue_stats()
+    statsd_client.gauge('logging.queue.depth', stats['depth'])
+    if stats['dropped'] > _log_queue_dropped_reported:
+        statsd_client.incr('logging.queue.dropped', stats['dropped'] - _log_queue_dropped_reported)
+        _log_queue_dropped_reported = stats['dropped']
+
+if app.config['LOG_QUEUE_ENABLED']:
+    start_log_queue()
+    atexit.register(stop_log_queue)
+    os.register_at_fork(after_in_child=lambda: start_log_queue() if log_queue_handler else None)
+else:
+    for handler in log_handlers:
+        logger.addHandler(handler)
 
 
 class HealthCheck(db.Model):
     __tablename__ = 'healthCheck'
     check_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    created_at = db.Column(db.DateTime, default=datetime.now, index=True)
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Supports the keyset-paginated listing ordered by (upload_date, id)
+        db.Index('ix_files_upload_date_id', 'upload_date', 'id'),
+        # Lets the reaper walk tombstones oldest first
+        db.Index('ix_files_deleted_at_id', 'deleted_at', 'id'),
+    )
     id = db.Column(db.String(36), primary_key=True)
     file_name = db.Column(db.String(255), nullable=False)
     url = db.Column(db.String(512), nullable=False)
     upload_date = db.Column(db.Date, default=date.today)
+    # SHA-256 of the content for deduplicated uploads; references a row in blobs
+    content_sha256 = db.Column(db.String(64), index=True)
+    # Set by an asynchronous delete; the row is gone for readers and waits for the reaper
+    deleted_at = db.Column(db.DateTime)
+    # Until when a reaper has claimed this tombstone; other reapers skip it
+    reap_claimed_until = db.Column(db.DateTime)
+    # 'gzip' when the stored object was compressed on upload
+    content_encoding = db.Column(db.String(16))
+
+class Blob(db.Model):
+    # One stored S3 object shared by every deduplicated file with the same content
+    __tablename__ = 'blobs'
+    digest = db.Column(db.String(64), primary_key=True)
+    s3_key = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    content_encoding = db.Column(db.String(16))
+
+class UploadReservation(db.Model):
+    # A presigned upload that has not been completed yet; completing it consumes the row
+    __tablename__ = 'upload_reservations'
+    id = db.Column(db.String(36), primary_key=True)
+    file_name = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class JobLease(db.Model):
+    # Which background job is held until when, so a job that every worker schedules runs only once
+    # per interval across all workers and instances
+    __tablename__ = 'job_leases'
+    name = db.Column(db.String(64), primary_key=True)
+    leased_until = db.Column(db.DateTime, nullable=False)
+
+def s3_client_error():
+    # botocore's ClientError, for except clauses. Any such error comes from an S3 client, which has
+    # already imported botocore, so this never triggers the import on the request path.
+    from botocore.exceptions import ClientError
+    return ClientError
+
+_s3_client = None
+_s3_client_pid = None
+_s3_clients_created = 0
+_s3_client_lock = threading.Lock()
+
+def create_s3_client():
+    # boto3 and botocore are imported on first use; they dominate the app's import time
+    import boto3
+    from botocore.config import Config as BotoConfig
+    config = BotoConfig(
+        max_pool_connections=app.config['S3_MAX_POOL_CONNECTIONS'],
+        retries={
+            'max_attempts': app.config['S3_MAX_ATTEMPTS'],
+            'mode': app.config['S3_RETRY_MODE']
+        },
+        connect_timeout=app.config['S3_CONNECT_TIMEOUT'],
+        read_timeout=app.config['S3_READ_TIMEOUT']
+    )
+    return boto3.client('s3', endpoint_url=app.config['S3_ENDPOINT_URL'], config=config)
 
 def get_s3_client():
-    return boto3.client('s3')
+    # Return the process-wide S3 client; boto3 clients are thread-safe and reuse pooled connections.
+    # A forked child builds its own client instead of sharing the parent's sockets.
+    global _s3_client, _s3_client_pid, _s3_clients_created
+    client = _s3_client
+    if client is not None and _s3_client_pid == os.getpid():
+        return client
+
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            _s3_client = create_s3_client()
+            _s3_client_pid = os.getpid()
+            _s3_clients_created += 1
+        return _s3_client
+
+def reset_s3_client():
+    global _s3_client, _s3_client_pid, _s3_client_lock
+    _s3_client = None
+    _s3_client_pid = None
+    # The lock may have been held by another thread when the process forked
+    _s3_client_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_s3_client)
+
+def s3_client_stats():
+    # Connection pool statistics for the shared S3 client
+    stats = {
+        'pid': os.getpid(),
+        'clients_created': _s3_clients_created,
+        'max_pool_connections': app.config['S3_MAX_POOL_CONNECTIONS'],
+        'pools': []
+    }
+    client = _s3_client
+    if client is None or _s3_client_pid != os.getpid():
+        return stats
+
+    try:
+        # botocore does not expose its urllib3 pools publicly
+        manager = client._endpoint.http_session._manager
+        for key in manager.pools.keys():
+            pool = manager.pools[key]
+            stats['pools'].append({
+                'host': pool.host,
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': pool.pool.qsize() if pool.pool else 0,
+                'max_size': pool.maxsize
+            })
+    except Exception:
+        pass
+    return stats
+
+def report_s3_client_stats():
+    stats = s3_client_stats()
+    statsd_client.gauge('s3.pool.clients_created', stats['clients_created'])
+    statsd_client.gauge('s3.pool.connections_created', sum(p['connections_created'] for p in stats['pools']))
+    statsd_client.gauge('s3.pool.idle_connections', sum(p['idle_connections'] for p in stats['pools']))
+
+def live_files():
+    # Files that have not been tombstoned by an asynchronous delete
+    return File.query.filter(File.deleted_at.is_(None))
+
+def serialize_file(file):
+    return {
+        "file_name": file.file_name,
+        "id": file.id,
+        "url": file.url,
+        "upload_date": file.upload_date.strftime("%Y-%m-%d")
+    }
+
+def s3_key_for(url, bucket_name):
+    return url.replace(f"{bucket_name}/", "", 1)
+
+def client_error_status(error):
+    return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+
+def delete_s3_objects(s3_client, bucket_name, keys):
+    # Delete keys with batched DeleteObjects calls; returns {key: error message} for failures
+    errors = {}
+    for start in range(0, len(keys), S3_DELETE_OBJECTS_MAX_KEYS):
+        batch = keys[start:start + S3_DELETE_OBJECTS_MAX_KEYS]
+        try:
+            result = time_s3_operation(
+                'delete_objects', s3_client.delete_objects,
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except Exception as e:
+            for key in batch:
+                errors[key] = str(e)
+            continue
+        for error in result.get('Errors', []):
+            errors[error['Key']] = f"{error.get('Code', '')}: {error.get('Message', '')}"
+    return errors
+
+def encode_list_cursor(file):
+    token = json.dumps([file.upload_date.strftime("%Y-%m-%d"), file.id]).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+def decode_list_cursor(cursor):
+    # Raises ValueError for a cursor we did not issue
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        upload_date, file_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return date.fromisoformat(upload_date), str(file_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+class FileMetadataCache:
+    # Bounded LRU cache of serialized File responses with TTL expiry.
+    # A value of None records that the id does not exist and expires sooner.
+    def __init__(self, name):
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, file_id):
+        # Returns (found, value); found is False when the database must be consulted
+        if app.config['FILE_CACHE_SIZE'] <= 0:
+            return False, None
+
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None and time.monotonic() >= entry[1]:
+                del self._entries[file_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(file_id)
+
+        if entry is None:
+            statsd_client.incr(f'{self.name}.miss')
+            return False, None
+        statsd_client.incr(f'{self.name}.hit' if entry[0] is not None else f'{self.name}.negative_hit')
+        return True, entry[0]
+
+    def put(self, file_id, value):
+        max_size = app.config['FILE_CACHE_SIZE']
+        if max_size <= 0:
+            return
+
+        ttl = app.config['FILE_CACHE_TTL'] if value is not None else app.config['FILE_CACHE_NEGATIVE_TTL']
+        evicted = 0
+        with self._lock:
+            self._entries[file_id] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(file_id)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            statsd_client.incr(f'{self.name}.eviction', evicted)
+
+    def invalidate(self, file_id):
+        with self._lock:
+            self._entries.pop(file_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+file_metadata_cache = FileMetadataCache('file_cache')
 
 def get_bucket_name():
     return os.getenv('S3_BUCKET_NAME')
 
+def empty_response(status):
+    return app.response_class(
+        response='',
+        status=status,
+        headers={
+            'Cache-Control': 'no-cache, no-store, must-revalidate',
+            'Pragma': 'no-cache',
+            'X-Content-Type-Options': 'nosniff'
+        }
+    )
+
+class S3StreamingUpload:
+    # Feeds a byte stream into S3, switching to a multipart upload once it outgrows one part.
+    # At most part_size bytes are buffered plus one part per in-flight upload slot. With a
+    # compress_level the stored object is gzip-compressed; size and sha256 cover the original bytes.
+    def __init__(self, s3_client, bucket_name, key, part_size, concurrency, extra_args=None, compress_level=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.extra_args = extra_args or {}
+        self.size = 0
+        self.stored_size = 0
+        self.completed = False
+        self.sha256 = hashlib.sha256()
+        self._compressor = None
+        if compress_level is not None:
+            self._compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._executor = None
+        self._parts = []
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def write(self, data):
+        self.size += len(data)
+        self.sha256.update(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._buffer += data
+        self.stored_size += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit_part(part)
+
+    def _submit_part(self, body):
+        if self._upload_id is None:
+            response = time_s3_operation(
+                'create_multipart_upload', self.s3_client.create_multipart_upload,
+                Bucket=self.bucket_name, Key=self.key, **self.extra_args
+            )
+            self._upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        # Fail fast instead of reading the rest of the body after a part has failed
+        for future in self._parts:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        # Blocks while every slot holds a part, which bounds memory per request
+        self._slots.acquire()
+        part_number = len(self._parts) + 1
+        context = contextvars.copy_context()
+        self._parts.append(self._executor.submit(context.run, self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = time_s3_operation(
+                'upload_part', self.s3_client.upload_part,
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+                PartNumber=part_number, Body=body
+            )
+            return {'ETag': response['ETag'], 'PartNumber': part_number}
+        finally:
+            self._slots.release()
+
+    def complete(self):
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._compressor = None
+            self._buffer += tail
+            self.stored_size += len(tail)
+        if self._upload_id is None:
+            # Small enough for a single request
+            time_s3_operation(
+                'put_object', self.s3_client.put_object,
+                Bucket=self.bucket_name, Key=self.key, Body=bytes(self._buffer), **self.extra_args
+            )
+            self._buffer.clear()
+            self.completed = True
+            return
+
+        if self._buffer:
+            self._submit_part(bytes(self._buffer))
+            self._buffer.clear()
+        parts = [future.result() for future in self._parts]
+        self._executor.shutdown()
+        time_s3_operation(
+            'complete_multipart_upload', self.s3_client.complete_multipart_upload,
+            Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        self.completed = True
+
+    def abort(self):
+        self._buffer.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self._upload_id is not None:
+            time_s3_operation(
+                'abort_multipart_upload', self.s3_client.abort_multipart_upload,
+                Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id
+            )
+
+def iter_request_multipart(chunk_size):
+    # Parse the multipart request body incrementally as it is read from the socket
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    stream = request.stream
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                break
+            yield event
+            if isinstance(event, Epilogue):
+                return
+        if not chunk:
+            return
+
 def time_s3_operation(operation_name, func, *args, **kwargs):
     # Time an S3 operation and record metrics
     start_time = time.time()
     try:
-        result = func(*args, **kwargs)
+        with trace_span(f's3.{operation_name}'):
+            result = func(*args, **kwargs)
         duration = (time.time() - start_time) * 1000  # Convert to milliseconds
         statsd_client.timing(f's3.{operation_name}', duration)
         
@@ -127,14 +1174,19 @@ def time_s3_operation(operation_name, func, *args, **kwargs):
         return result
     except Exception as e:
         duration = (time.time() - start_time) * 1000
-        statsd_client.timing(f's3.{operation_name}.error', duration)
-        
         extra = {
             'operation': f's3.{operation_name}',
             'duration_ms': f"{duration:.2f}",
             'path': request.path if request else '',
             'method': request.method if request else ''
         }
+        if isinstance(e, s3_client_error()) and client_error_status(e) in (304, 412):
+            # Not Modified / Precondition Failed answer a conditional request; they are not failures
+            statsd_client.timing(f's3.{operation_name}', duration)
+            logger.info(f"S3 operation {operation_name} returned {client_error_status(e)}", extra=extra)
+            raise
+        
+        statsd_client.timing(f's3.{operation_name}.error', duration)
         logger.error(f"S3 operation {operation_name} failed: {str(e)}", exc_info=True, extra=extra)
         raise
 
@@ -142,7 +1194,8 @@ def time_db_operation(operation_name, func, *args, **kwargs):
     # Time a database operation and record metrics
     start_time = time.time()
     try:
-        result = func(*args, **kwargs)
+        with trace_span(f'db.{operation_name}'):
+            result = func(*args, **kwargs)
         duration = (time.time() - start_time) * 1000  # Convert to milliseconds
         statsd_client.timing(f'db.{operation_name}', duration)
         
@@ -167,17 +1220,708 @@ def time_db_operation(operation_name, func, *args, **kwargs):
         logger.error(f"Database operation {operation_name} failed: {str(e)}", exc_info=True, extra=extra)
         raise
 
+class ReplicaRouter:
+    # Decides whether a read may go to the replica: not while the replica is marked down, and not for
+    # a client that wrote file metadata within the last read_after_write seconds (read-your-writes).
+    # A write is remembered for the writing client only, with a cookie holding the time until which
+    # its reads stay on the primary; other clients keep reading from the replica.
+    COOKIE = 'primary_until'
+
+    def __init__(self):
+        self._down_until = 0.0
+
+    def record_write(self):
+        if has_request_context():
+            g.wrote_file_metadata = True
+
+    def mark_down(self, seconds):
+        self._down_until = time.monotonic() + seconds
+
+    def pinned_to_primary(self):
+        if not has_request_context():
+            return False
+        if g.get('wrote_file_metadata'):
+            return True
+        try:
+            return time.time() < float(request.cookies.get(self.COOKIE, '0'))
+        except ValueError:
+            return False
+
+    def use_replica(self, read_after_write):
+        if time.monotonic() < self._down_until:
+            return False
+        return read_after_write <= 0 or not self.pinned_to_primary()
+
+    def pin_response(self, response, read_after_write):
+        # Sends the cookie that keeps a client that just wrote on the primary
+        if read_after_write > 0:
+            response.set_cookie(
+                self.COOKIE, f"{time.time() + read_after_write:.3f}",
+                max_age=math.ceil(read_after_write), httponly=True, samesite='Lax'
+            )
+        return response
+
+replica_router = ReplicaRouter()
+
+def read_db_operation(operation_name, func, *args, retry_on_primary=None, **kwargs):
+    # Time a read-only database operation, running it on the read replica when possible.
+    # Falls back to the primary when the replica fails, and retries there when
+    # retry_on_primary(result) says the replica may not have caught up yet.
+    if 'replica' not in db.engines or not replica_router.use_replica(app.config['DB_REPLICA_READ_AFTER_WRITE']):
+        return time_db_operation(operation_name, func, *args, **kwargs)
+
+    replica_failed = False
+    token = _read_replica.set(True)
+    try:
+        result = time_db_operation(operation_name, func, *args, **kwargs)
+    except OperationalError as e:
+        replica_failed = True
+        db.session.rollback()
+        replica_router.mark_down(app.config['DB_REPLICA_RETRY_INTERVAL'])
+        statsd_client.incr('db.replica.fallback')
+        
+        extra = {
+            'operation': f'db.{operation_name}',
+            'path': request.path if request else '',
+            'method': request.method if request else ''
+        }
+        logger.warning(f"Read replica unavailable, reading from primary: {str(e)}", extra=extra)
+    finally:
+        _read_replica.reset(token)
+    
+    if replica_failed:
+        return time_db_operation(operation_name, func, *args, **kwargs)
+    statsd_client.incr('db.replica.read')
+    if retry_on_primary and retry_on_primary(result):
+        statsd_client.incr('db.replica.primary_retry')
+        return time_db_operation(operation_name, func, *args, **kwargs)
+    return result
+
+class SingleFlightCache:
+    # Shares one in-flight call between concurrent callers and reuses its outcome for a TTL
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._error = None
+        self._expires_at = 0.0
+        self._inflight = None
+
+    def clear(self):
+        with self._lock:
+            self._error = None
+            self._expires_at = 0.0
+
+    def get(self, ttl, func):
+        # Returns the exception raised by func, or None if it succeeded
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                statsd_client.incr(f'{self.name}.cache.hit')
+                return self._error
+            inflight = self._inflight
+            if inflight is None:
+                inflight = self._inflight = {'done': threading.Event(), 'error': None}
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            # Another request is already checking; wait for its outcome
+            inflight['done'].wait()
+            statsd_client.incr(f'{self.name}.cache.hit')
+            statsd_client.incr(f'{self.name}.cache.coalesced')
+            return inflight['error']
+
+        statsd_client.incr(f'{self.name}.cache.miss')
+        error = None
+        try:
+            func()
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                inflight['error'] = error
+                self._error = error
+                self._expires_at = time.monotonic() + ttl
+                self._inflight = None
+            inflight['done'].set()
+        return error
+
+health_check_cache = SingleFlightCache('health_check')
+health_check_ping_cache = SingleFlightCache('health_check_ping')
+
+class ConcurrencyLimiter:
+    # Caps concurrent requests in one endpoint group, with a short bounded queue for a free slot
+    def __init__(self, name):
+        self.name = name
+        self._condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self, limit, queue_size, queue_timeout):
+        # Returns (admitted, reason, seconds spent waiting)
+        with self._condition:
+            # Arrivals queue behind existing waiters so a freed slot goes to the longest waiter
+            if self.active < limit and self.waiting == 0:
+                self.active += 1
+                return True, None, 0.0
+            if self.waiting >= queue_size:
+                return False, 'queue_full', 0.0
+
+            self.waiting += 1
+            start = time.perf_counter()
+            try:
+                admitted = self._condition.wait_for(lambda: self.active < limit, queue_timeout)
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted, None if admitted else 'timeout', time.perf_counter() - start
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+admission_limiters = {}
+admission_limiters_lock = threading.Lock()
+
+def get_admission_limiter(group):
+    with admission_limiters_lock:
+        limiter = admission_limiters.get(group)
+        if limiter is None:
+            limiter = admission_limiters[group] = ConcurrencyLimiter(group)
+        return limiter
+
+def run_periodically(name, interval, func):
+    # Run func every interval seconds on a daemon thread inside an app context
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    func()
+            except Exception as e:
+                extra = {'path': '', 'method': '', 'remote_addr': ''}
+                logger.error(f"Background job {name} failed: {str(e)}", exc_info=True, extra=extra)
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def claim_job_lease(name, duration):
+    # Take the lease on a background job for duration seconds if nobody holds it. The UPDATE only
+    # matches an expired lease, so when several workers race exactly one of them gets a row back.
+    now = datetime.now()
+    leased_until = now + timedelta(seconds=duration)
+    try:
+        statement = JobLease.__table__.update().where(
+            JobLease.name == name, JobLease.leased_until < now
+        ).values(leased_until=leased_until)
+        claimed = time_db_operation('claim_job_lease', db.session.execute, statement).rowcount == 1
+        if not claimed and time_db_operation('get_job_lease', db.session.get, JobLease, name) is None:
+            # First run of this job anywhere; a concurrent insert by another worker fails the commit
+            db.session.add(JobLease(name=name, leased_until=leased_until))
+            claimed = True
+        time_db_operation('claim_job_lease_commit', db.session.commit)
+        return claimed
+    except IntegrityError:
+        time_db_operation('claim_job_lease_rollback', db.session.rollback)
+        return False
+    except Exception:
+        time_db_operation('claim_job_lease_rollback', db.session.rollback)
+        raise
+
+def run_with_lease(name, duration, func):
+    # Run func only in the worker that holds the job's lease this round
+    if not claim_job_lease(name, duration):
+        return None
+    return func()
+
+class HealthCheckWriteBuffer:
+    # Gathers health check timestamps and writes them as one multi-row INSERT
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._last_error = None
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, created_at):
+        with self._lock:
+            self._pending.append(created_at)
+            pending = len(self._pending)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = run_periodically(
+                    'health_check_flusher', app.config['HEALTH_CHECK_FLUSH_INTERVAL'], self.flush
+                )
+
+        if pending >= app.config['HEALTH_CHECK_FLUSH_ROWS']:
+            self.flush()
+        elif self._last_error is not None:
+            # Keep reporting unhealthy until a flush reaches the database again
+            raise RuntimeError(f"Health check flush failed: {self._last_error}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+
+            lag = (datetime.now() - rows[0]).total_seconds() * 1000
+            try:
+                statement = HealthCheck.__table__.insert().values([{'created_at': ts} for ts in rows])
+                time_db_operation('health_check_batch_insert', db.session.execute, statement)
+                time_db_operation('health_check_batch_commit', db.session.commit)
+            except Exception as e:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+                with self._lock:
+                    # Re-queue the rows, bounded so an outage cannot grow the buffer forever
+                    limit = app.config['HEALTH_CHECK_FLUSH_ROWS'] * 10
+                    self._pending = (rows + self._pending)[-limit:]
+                    self._last_error = e
+                statsd_client.incr('health_check.write_behind.flush_error')
+                raise
+
+            self._last_error = None
+            statsd_client.gauge('health_check.write_behind.flush_size', len(rows))
+            statsd_client.incr('health_check.write_behind.rows', len(rows))
+            statsd_client.timing('health_check.write_behind.lag', lag)
+            return len(rows)
+
+health_check_buffer = HealthCheckWriteBuffer()
+
+def flush_health_check_buffer():
+    try:
+        with app.app_context():
+            health_check_buffer.flush()
+    except Exception as e:
+        print(f"Failed to flush health check buffer: {e}")
+
+atexit.register(flush_health_check_buffer)
+
+def purge_health_checks(retention_days, batch_size):
+    # Delete health check rows older than the retention window in bounded batches
+    start_time = time.time()
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = [
+            row.check_id for row in HealthCheck.query.with_entities(HealthCheck.check_id)
+            .filter(HealthCheck.created_at < cutoff)
+            .order_by(HealthCheck.check_id)
+            .limit(batch_size)
+        ]
+        if not ids:
+            break
+
+        statement = HealthCheck.__table__.delete().where(HealthCheck.check_id.in_(ids))
+        time_db_operation('health_check_purge', db.session.execute, statement)
+        time_db_operation('health_check_purge_commit', db.session.commit)
+        deleted += len(ids)
+        statsd_client.gauge('health_check.retention.batch_size', len(ids))
+        if len(ids) < batch_size:
+            break
+
+    duration = (time.time() - start_time) * 1000
+    statsd_client.incr('health_check.retention.deleted', deleted)
+    statsd_client.timing('health_check.retention.time', duration)
+
+    extra = {'path': '', 'method': '', 'remote_addr': '', 'duration_ms': f"{duration:.2f}"}
+    logger.info(f"Purged {deleted} health check rows older than {cutoff.isoformat()}", extra=extra)
+    return deleted
+
+def claim_tombstoned_files(batch_size, cursor):
+    # Lease the next batch of tombstones past cursor that no other reaper holds, so every worker
+    # deletes a different batch. Rows being claimed elsewhere are skipped rather than waited for.
+    now = datetime.now()
+    query = db.session.query(File.id, File.url, File.content_sha256, File.deleted_at).filter(
+        File.deleted_at.isnot(None),
+        db.or_(File.reap_claimed_until.is_(None), File.reap_claimed_until < now)
+    )
+    if cursor is not None:
+        # Seek past the previous batch so files that keep failing do not block the rest
+        last_deleted_at, last_id = cursor
+        query = query.filter(
+            File.deleted_at >= last_deleted_at,
+            db.or_(File.deleted_at > last_deleted_at, File.id > last_id)
+        )
+    try:
+        batch = time_db_operation(
+            'claim_tombstoned_files',
+            query.order_by(File.deleted_at, File.id).limit(batch_size).with_for_update(skip_locked=True).all
+        )
+        if batch:
+            statement = File.__table__.update().where(File.id.in_([row.id for row in batch])).values(
+                reap_claimed_until=now + timedelta(seconds=app.config['FILE_REAPER_LEASE'])
+            )
+            time_db_operation('claim_tombstoned_files_update', db.session.execute, statement)
+        time_db_operation('claim_tombstoned_files_commit', db.session.commit)
+    except Exception:
+        time_db_operation('file_reap_rollback', db.session.rollback)
+        raise
+    return batch
+
+def reap_deleted_files(batch_size):
+    # Delete the S3 objects and rows of tombstoned files, oldest first and in batches. Each batch is
+    # claimed before its objects are deleted, so concurrent reapers never work on the same files.
+    # Files whose object could not be deleted stay tombstoned for a later run. Returns (reaped, failed).
+    start_time = time.time()
+    s3_client = get_s3_client()
+    bucket_name = get_bucket_name()
+    extra = {'path': '', 'method': '', 'remote_addr': ''}
+    reaped = 0
+    failed = 0
+    cursor = None
+    while True:
+        batch = claim_tombstoned_files(batch_size, cursor)
+        if not batch:
+            break
+        cursor = (batch[-1].deleted_at, batch[-1].id)
+
+        # Deduplicated objects are shared, so they are released with the rows instead
+        keys = {file.id: s3_key_for(file.url, bucket_name) for file in batch if not file.content_sha256}
+        s3_errors = delete_s3_objects(s3_client, bucket_name, list(dict.fromkeys(keys.values())))
+        done_ids = [file.id for file in batch if keys.get(file.id) not in s3_errors]
+        failed_ids = [file.id for file in batch if keys.get(file.id) in s3_errors]
+        failed += len(failed_ids)
+
+        files = []
+        try:
+            if done_ids:
+                # Lock the rows so a reaper whose lease expired meanwhile releases each blob reference only once
+                files = time_db_operation(
+                    'get_tombstoned_files_for_update',
+                    File.query.filter(File.id.in_(done_ids), File.deleted_at.isnot(None)).with_for_update().all
+                )
+                orphaned = release_blobs(files)
+                statement = File.__table__.delete().where(File.id.in_([file.id for file in files]))
+                time_db_operation('file_reap', db.session.execute, statement)
+            if failed_ids:
+                # Hand failed files back so the next run, in any worker, retries them
+                statement = File.__table__.update().where(File.id.in_(failed_ids)).values(reap_claimed_until=None)
+                time_db_operation('file_reap_release', db.session.execute, statement)
+            time_db_operation('file_reap_commit', db.session.commit)
+        except Exception:
+            time_db_operation('file_reap_rollback', db.session.rollback)
+            raise
+        if files:
+            reaped += len(files)
+            for key, error in delete_s3_objects(s3_client, bucket_name, orphaned).items():
+                logger.error(f"Error deleting unreferenced blob {key}: {error}", extra=extra)
+
+        statsd_client.gauge('files.reaper.batch_size', len(batch))
+        if len(batch) < batch_size:
+            break
+
+    backlog = time_db_operation('count_tombstoned_files', File.query.filter(File.deleted_at.isnot(None)).count)
+    oldest = time_db_operation(
+        'oldest_tombstoned_file', db.session.query(db.func.min(File.deleted_at)).scalar
+    )
+    lag = (datetime.now() - oldest).total_seconds() if oldest else 0
+    duration = (time.time() - start_time) * 1000
+    statsd_client.gauge('files.reaper.backlog', backlog)
+    statsd_client.gauge('files.reaper.lag', lag)
+    statsd_client.incr('files.reaper.reaped', reaped)
+    if failed:
+        statsd_client.incr('files.reaper.failed', failed)
+    statsd_client.timing('files.reaper.time', duration)
+
+    if reaped or failed:
+        extra['duration_ms'] = f"{duration:.2f}"
+        logger.info(
+            f"Reaped {reaped} deleted files, {failed} failed, {backlog} waiting (oldest {lag:.0f}s)", extra=extra
+        )
+    return reaped, failed
+
+class FileReaper:
+    # Runs reap_deleted_files every FILE_REAPER_INTERVAL seconds. Runs that make no progress, such
+    # as during an S3 outage, double the wait up to FILE_REAPER_MAX_BACKOFF.
+    def __init__(self):
+        self.failures = 0
+        self.next_run = 0.0
+
+    def run(self):
+        if time.monotonic() < self.next_run:
+            return None
+        try:
+            reaped, failed = reap_deleted_files(app.config['FILE_REAPER_BATCH_SIZE'])
+        except Exception:
+            self._back_off()
+            raise
+        if failed and not reaped:
+            self._back_off()
+        else:
+            self.failures = 0
+            self.next_run = 0.0
+        return reaped, failed
+
+    def _back_off(self):
+        self.failures += 1
+        delay = min(
+            app.config['FILE_REAPER_INTERVAL'] * 2 ** self.failures, app.config['FILE_REAPER_MAX_BACKOFF']
+        )
+        self.next_run = time.monotonic() + delay
+        statsd_client.gauge('files.reaper.backoff', delay)
+
+file_reaper = FileReaper()
+
+def purge_upload_reservations():
+    # Drop reservations of presigned uploads that were never completed
+    statement = UploadReservation.__table__.delete().where(UploadReservation.expires_at < datetime.now())
+    result = time_db_operation('upload_reservation_purge', db.session.execute, statement)
+    time_db_operation('upload_reservation_purge_commit', db.session.commit)
+    statsd_client.incr('upload.reservations.expired', result.rowcount)
+    return result.rowcount
+
+def start_background_jobs():
+    # Start the periodic maintenance jobs enabled by configuration
+    if log_queue_handler is not None and app.config['LOG_QUEUE_STATS_INTERVAL'] > 0:
+        run_periodically('log_queue_stats', app.config['LOG_QUEUE_STATS_INTERVAL'], report_log_queue_stats)
+    if app.config['S3_STATS_INTERVAL'] > 0:
+        run_periodically('s3_client_stats', app.config['S3_STATS_INTERVAL'], report_s3_client_stats)
+    if app.config['HEALTH_CHECK_RETENTION_DAYS'] > 0:
+        # Every worker schedules the purge, but only the one that takes the lease runs it
+        interval = app.config['HEALTH_CHECK_RETENTION_INTERVAL']
+        run_periodically(
+            'health_check_retention',
+            interval,
+            lambda: run_with_lease('health_check_retention', interval, lambda: purge_health_checks(
+                app.config['HEALTH_CHECK_RETENTION_DAYS'],
+                app.config['HEALTH_CHECK_RETENTION_BATCH_SIZE']
+            ))
+        )
+    if app.config['UPLOAD_RESERVATION_PURGE_INTERVAL'] > 0:
+        interval = app.config['UPLOAD_RESERVATION_PURGE_INTERVAL']
+        run_periodically(
+            'upload_reservation_purge',
+            interval,
+            lambda: run_with_lease('upload_reservation_purge', interval, purge_upload_reservations)
+        )
+    if app.config['FILE_DELETE_ASYNC'] and app.config['FILE_REAPER_INTERVAL'] > 0:
+        run_periodically('file_reaper', app.config['FILE_REAPER_INTERVAL'], file_reaper.run)
+
+class WarmUpState:
+    # Which dependencies this process has warmed up; database and S3 are required for readiness
+    REQUIRED = ('database', 's3')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components = {}
+
+    def set(self, name, ready):
+        with self._lock:
+            self._components[name] = ready
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._components)
+
+    def ready(self):
+        components = self.snapshot()
+        return all(components.get(name) for name in self.REQUIRED)
+
+    def clear(self):
+        with self._lock:
+            self._components = {}
+
+warm_up_state = WarmUpState()
+
+def upgrade_schema(engine):
+    # create_all() leaves existing tables alone, so add the columns and indexes that later versions
+    # introduced to tables an older version created. New columns are nullable, so no backfill is
+    # needed. Each statement runs on its own, and one that another instance already applied is
+    # skipped. Returns the statements that were applied.
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Cannot add required column {table.name}.{column.name} to an existing table")
+            statements.append(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                f"{column.type.compile(dialect=engine.dialect)}"
+            )
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        statements.extend(
+            str(CreateIndex(index).compile(dialect=engine.dialect))
+            for index in table.indexes if index.name not in indexes
+        )
+
+    applied = []
+    for statement in statements:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(statement))
+        except Exception as e:
+            message = str(e).lower()
+            if 'duplicate' not in message and 'already exists' not in message:
+                raise
+            continue
+        applied.append(statement)
+    return applied
+
 def bootstrap_db():
+    # Create missing tables, and upgrade tables from older versions, once per deployment step: in the
+    # gunicorn master before workers fork, or before `python app.py` serves. Failures are logged rather
+    # than raised so startup is not blocked; readiness still depends on each worker reaching the database.
+    extra = {'path': '', 'method': '', 'remote_addr': ''}
     try:
         with app.app_context():
-            db.create_all()
-            extra = {'path': '', 'method': '', 'remote_addr': ''}
-            logger.info("Database initialized successfully", extra=extra)
+            try:
+                db.create_all()
+            except Exception as e:
+                if 'already exists' not in str(e).lower():
+                    raise
+                # Another instance created a table meanwhile, and create_all stopped there. Run it
+                # again so the tables after it are created too; it skips the ones that exist now.
+                logger.info(f"Table created concurrently, retrying schema creation: {e}", extra=extra)
+                db.create_all()
+            for statement in upgrade_schema(db.engine):
+                logger.info(f"Database schema upgraded: {statement}", extra=extra)
+            # Workers open their own connections after the fork
+            for engine in db.engines.values():
+                engine.dispose()
+        logger.info("Database initialized successfully", extra=extra)
+        return True
     except Exception as e:
-        error_msg = f"Exception occurred while creating database: {e}"
+        logger.error(f"Exception occurred while creating database: {e}", exc_info=True, extra=extra)
+        return False
+
+def warm_up_database():
+    # Opens the first pooled connection; the schema is created once by bootstrap_db()
+    with app.app_context():
+        time_db_operation('warm_up_ping', db.session.execute, text('SELECT 1'))
+
+def warm_up_cloudwatch():
+    if cloudwatch_handler is not None and cloudwatch_handler.target is None:
+        cloudwatch_handler.set_target(create_cloudwatch_handler())
         extra = {'path': '', 'method': '', 'remote_addr': ''}
-        logger.error(error_msg, exc_info=True, extra=extra)
-        print(error_msg)
+        logger.info("CloudWatch logging initialized successfully", extra=extra)
+
+# CloudWatch goes last so a slow log group call does not hold back readiness
+WARM_UP_STEPS = [
+    ('database', warm_up_database),
+    ('s3', get_s3_client),
+    ('cloudwatch', warm_up_cloudwatch)
+]
+
+def warm_up():
+    # Run every warm-up step, retrying failed ones every WARM_UP_RETRY_INTERVAL seconds until they succeed
+    pending = list(WARM_UP_STEPS)
+    while pending:
+        failed = []
+        for name, step in pending:
+            start_time = time.time()
+            try:
+                step()
+                warm_up_state.set(name, True)
+                duration = (time.time() - start_time) * 1000
+                statsd_client.timing(f'startup.warm_up.{name}', duration)
+                extra = {'path': '', 'method': '', 'remote_addr': '', 'duration_ms': f"{duration:.2f}"}
+                logger.info(f"Warm-up of {name} completed", extra=extra)
+            except Exception as e:
+                warm_up_state.set(name, False)
+                failed.append((name, step))
+                extra = {'path': '', 'method': '', 'remote_addr': ''}
+                logger.warning(f"Warm-up of {name} failed: {str(e)}", extra=extra)
+        pending = failed
+        if pending:
+            if app.config['WARM_UP_RETRY_INTERVAL'] <= 0:
+                return
+            time.sleep(app.config['WARM_UP_RETRY_INTERVAL'])
+
+def start_warm_up():
+    # Warm up in the background so the process serves requests, and restarts, without waiting on AWS
+    warm_up_state.clear()
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+def init_worker():
+    # Called in each server worker right after it is forked from the master process
+    with app.app_context():
+        # Connections opened in the master must not be shared with children
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    reset_s3_client()
+    start_background_jobs()
+    start_warm_up()
+    
+    extra = {'path': '', 'method': '', 'remote_addr': ''}
+    logger.info(f"Worker {os.getpid()} initialized", extra=extra)
+
+def shutdown_worker():
+    # Flush buffered state before a worker exits; in-flight requests have already drained
+    flush_health_check_buffer()
+    statsd_client.flush()
+    
+    extra = {'path': '', 'method': '', 'remote_addr': ''}
+    logger.info(f"Worker {os.getpid()} shutting down", extra=extra)
+
+def ping_database():
+    try:
+        time_db_operation('health_check_ping', db.session.execute, text('SELECT 1'))
+    except Exception:
+        db.session.rollback()
+        raise
+
+def check_database_health():
+    # Record a health check row; raises if the database is unavailable
+    if app.config['HEALTH_CHECK_WRITE_BEHIND']:
+        health_check_buffer.add(datetime.now())
+        # The row is only written by a later flush, so confirm the database answers with a SELECT 1
+        # shared by all probes within one flush interval
+        error = health_check_ping_cache.get(app.config['HEALTH_CHECK_FLUSH_INTERVAL'], ping_database)
+        if error is not None:
+            raise RuntimeError(f"Health check ping failed: {error}")
+        return
+
+    new_check = HealthCheck()
+    time_db_operation('health_check_insert', db.session.add, new_check)
+    time_db_operation('health_check_commit', db.session.commit)
+
+def run_health_check():
+    ttl = app.config['HEALTH_CHECK_CACHE_TTL']
+    if ttl <= 0:
+        check_database_health()
+        return
+
+    error = health_check_cache.get(ttl, check_database_health)
+    if error is not None:
+        raise RuntimeError(f"Cached health check failure: {error}")
+
+@app.before_request
+def start_request_metrics():
+    statsd_client.start_request()
+
+@app.teardown_request
+def flush_request_metrics(exception):
+    statsd_client.finish_request()
+
+@app.before_request
+def start_request_trace():
+    if app.config['REQUEST_TRACING']:
+        g.trace = RequestTrace(request.method, request.path)
+
+@app.after_request
+def finish_request_trace(response):
+    trace = current_trace()
+    if trace is not None:
+        trace.finish(response.status_code)
+        response.headers['Server-Timing'] = trace.server_timing()
+        slow_requests.record(trace, app.config['TRACE_SLOW_REQUESTS'])
+    return response
 
 @app.before_request
 def log_request_info():
@@ -188,6 +1932,60 @@ def log_request_info():
     }
     logger.info(f"Request received", extra=extra)
 
+@app.before_request
+def admit_request():
+    group = app.config['ADMISSION_GROUPS'].get(request.endpoint)
+    limit = app.config['ADMISSION_LIMITS'].get(group, 0)
+    if not limit:
+        return None
+
+    limiter = get_admission_limiter(group)
+    admitted, reason, waited = limiter.acquire(
+        limit, app.config['ADMISSION_QUEUE_SIZE'], app.config['ADMISSION_QUEUE_TIMEOUT']
+    )
+    if waited:
+        statsd_client.timing(f'admission.{group}.queue_wait', waited * 1000)
+    if admitted:
+        g.admission_limiter = limiter
+        return None
+
+    statsd_client.incr(f'admission.{group}.rejected')
+    statsd_client.incr(f'admission.{group}.rejected.{reason}')
+    extra = {
+        'path': request.path,
+        'method': request.method,
+        'remote_addr': request.remote_addr,
+        'group': group,
+        'reason': reason,
+        'active': limiter.active,
+        'waiting': limiter.waiting
+    }
+    logger.warning(f"Request shed by admission control", extra=extra)
+    response = empty_response(503)
+    response.headers['Retry-After'] = str(app.config['ADMISSION_RETRY_AFTER'])
+    return response
+
+@app.after_request
+def hold_admission_until_sent(response):
+    # A streamed body keeps its slot until the server has finished sending it
+    limiter = g.pop('admission_limiter', None)
+    if limiter is not None:
+        response.call_on_close(limiter.release)
+    return response
+
+@app.after_request
+def pin_writer_to_primary(response):
+    if g.pop('wrote_file_metadata', False) and 'replica' in db.engines:
+        replica_router.pin_response(response, app.config['DB_REPLICA_READ_AFTER_WRITE'])
+    return response
+
+@app.teardown_request
+def release_admission(exception):
+    # Fallback for requests that never produced a response
+    limiter = g.pop('admission_limiter', None)
+    if limiter is not None:
+        limiter.release()
+
 @app.after_request
 def log_response_info(response):
     extra = {
@@ -199,6 +1997,22 @@ def log_response_info(response):
     logger.info(f"Response sent", extra=extra)
     return response
 
+@app.after_request
+def apply_cache_policy(response):
+    # Runs before log_response_info so a 304 is logged as such
+    cache_control = app.config['CACHE_POLICIES'].get(request.endpoint)
+    if cache_control is None or response.status_code not in (200, 206, 304):
+        return response
+    
+    response.headers['Cache-Control'] = cache_control
+    response.headers.pop('Pragma', None)
+    if request.endpoint in app.config['CACHE_ETAG_ENDPOINTS'] and response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(request)
+        if response.status_code == 304:
+            statsd_client.incr(f'api.{request.endpoint}.not_modified')
+    return response
+
 @app.route('/healthz', methods=['GET'])
 def health_check():
     start_time = time.time()
@@ -235,9 +2049,7 @@ def health_check():
         return response
     
     try:
-        new_check = HealthCheck()
-        time_db_operation('health_check_insert', db.session.add, new_check)
-        time_db_operation('health_check_commit', db.session.commit)
+        run_health_check()
         
         extra = {
             'path': request.path,
@@ -319,9 +2131,7 @@ def cicd():
         return response
     
     try:
-        new_check = HealthCheck()
-        time_db_operation('health_check_insert', db.session.add, new_check)
-        time_db_operation('health_check_commit', db.session.commit)
+        run_health_check()
         
         extra = {
             'path': request.path,
@@ -400,6 +2210,9 @@ def upload_file():
         statsd_client.timing('api.upload_file.time', duration)
         return response
     
+    if app.config['UPLOAD_STREAMING'] and request.mimetype == 'multipart/form-data':
+        return upload_file_streaming(start_time)
+    
     # Check if the request has a file
     if 'file' not in request.files:
         extra = {
@@ -421,114 +2234,690 @@ def upload_file():
         statsd_client.timing('api.upload_file.time', duration)
         return response
     
-    file = request.files['file']
+    file = request.files['file']
+    
+    # Check if file is empty
+    if file.filename == '':
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.warning("Upload attempt with empty filename", extra=extra)
+        response = app.response_class(
+            response='',
+            status=400,
+            headers = {
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache',
+                'X-Content-Type-Options': 'nosniff'
+            }
+        )
+        duration = (time.time() - start_time) * 1000
+        statsd_client.timing('api.upload_file.time', duration)
+        return response
+    
+    try:
+        # Generate secure filename and unique ID
+        file_id = str(uuid.uuid4())
+        filename = secure_filename(file.filename)
+        
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': file_id,
+            'file_name': filename
+        }
+        logger.info(f"Processing file upload", extra=extra)
+        
+        # Get S3 client and bucket name
+        s3_client = get_s3_client()
+        bucket_name = get_bucket_name()
+        
+        # Define S3 path/key; deduplicated content goes to its own blob key
+        s3_key = blob_key(file_id) if app.config['UPLOAD_DEDUP'] else f"{file_id}/{filename}"
+        
+        # Create URL
+        url = f"{bucket_name}/{s3_key}"
+        
+        source = file
+        extra_args = None
+        content_encoding = None
+        if app.config['UPLOAD_COMPRESSION']:
+            sample = file.stream.read(app.config['UPLOAD_COMPRESS_SAMPLE_SIZE'])
+            file.stream.seek(0)
+            content_type = upload_content_type(file.mimetype, filename)
+            if should_compress(content_type, sample, len(sample) < app.config['UPLOAD_COMPRESS_SAMPLE_SIZE']):
+                source = GzipReader(file.stream, app.config['UPLOAD_COMPRESS_LEVEL'], app.config['UPLOAD_READ_CHUNK_SIZE'])
+                extra_args = {'ContentType': content_type, 'ContentEncoding': 'gzip'}
+                content_encoding = 'gzip'
+                statsd_client.incr('upload.compression.compressed')
+            else:
+                statsd_client.incr('upload.compression.skipped')
+        
+        def store():
+            time_s3_operation(
+                'upload_file', s3_client.upload_fileobj, source, bucket_name, s3_key, ExtraArgs=extra_args
+            )
+        
+        if app.config['UPLOAD_DEDUP']:
+            digest, size = hash_file_storage(file, app.config['UPLOAD_READ_CHUNK_SIZE'])
+            response = save_file_deduplicated(
+                file_id, filename, digest, size, s3_client, bucket_name, s3_key,
+                store, lambda: None, content_encoding
+            )
+        elif app.config['UPLOAD_OVERLAP_DB_WRITE']:
+            response = save_file_overlapped(store, s3_client, bucket_name, s3_key, file_id, filename, content_encoding)
+        else:
+            # Upload to S3 with timing
+            store()
+            
+            # Store metadata in database
+            response = save_file_metadata(file_id, filename, url, content_encoding=content_encoding)
+        
+        if isinstance(source, GzipReader) and source.size_out:
+            report_compression(source.size_in, source.size_out)
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': file_id,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"File uploaded successfully", extra=extra)
+        
+        statsd_client.timing('api.upload_file.time', duration)
+        return jsonify(response), 201
+        
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error uploading file: {str(e)}", exc_info=True, extra=extra)
+        
+        try:
+            time_db_operation('file_rollback', db.session.rollback)
+        except:
+            pass
+            
+        response = app.response_class(
+            response='',
+            status=400,
+            headers = {
+                'Cache-Control': 'no-cache, no-store, must-revalidate',
+                'Pragma': 'no-cache',
+                'X-Content-Type-Options': 'nosniff'
+            }
+        )
+        statsd_client.timing('api.upload_file.time', duration)
+        return response
+
+def save_file_metadata(file_id, filename, url, content_sha256=None, content_encoding=None):
+    # Store metadata for an uploaded object and return its API representation
+    new_file = File(
+        id=file_id,
+        file_name=filename,
+        url=url,
+        upload_date=date.today(),
+        content_sha256=content_sha256,
+        content_encoding=content_encoding
+    )
+    
+    time_db_operation('file_insert', db.session.add, new_file)
+    time_db_operation('file_commit', db.session.commit)
+    replica_router.record_write()
+    
+    file_data = serialize_file(new_file)
+    file_metadata_cache.put(file_id, file_data)
+    return file_data
+
+def hash_file_storage(file, chunk_size):
+    # SHA-256 and size of an uploaded file that Werkzeug has already spooled, leaving it rewound
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = file.stream.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    file.stream.seek(0)
+    return digest.hexdigest(), size
+
+def upload_content_type(declared, filename):
+    # The type the client sent for the file part, or one guessed from the file name if it sent none
+    declared = (declared or '').split(';')[0].strip().lower()
+    if declared and declared != 'application/octet-stream':
+        return declared
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def sample_entropy(sample):
+    # Shannon entropy of the sample in bits per byte
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+def should_compress(content_type, sample, complete):
+    # sample is the start of the file, or all of it when complete is true
+    if complete and len(sample) < app.config['UPLOAD_COMPRESS_MIN_SIZE']:
+        return False
+    if any(fnmatch.fnmatchcase(content_type, pattern) for pattern in app.config['UPLOAD_COMPRESS_TYPES']):
+        return True
+    return bool(sample) and sample_entropy(sample) <= app.config['UPLOAD_COMPRESS_MAX_ENTROPY']
+
+class GzipReader(io.RawIOBase):
+    # Non-seekable file object that reads another stream and returns it gzip-compressed
+    def __init__(self, stream, level, chunk_size):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._eof = False
+        self.size_in = 0
+        self.size_out = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self._buffer) < len(target) and not self._eof:
+            chunk = self._stream.read(self._chunk_size)
+            if chunk:
+                self.size_in += len(chunk)
+                self._buffer += self._compressor.compress(chunk)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+        count = min(len(target), len(self._buffer))
+        target[:count] = self._buffer[:count]
+        del self._buffer[:count]
+        self.size_out += count
+        return count
+
+def report_compression(size_in, size_out):
+    statsd_client.incr('upload.compression.bytes_in', size_in)
+    statsd_client.incr('upload.compression.bytes_out', size_out)
+
+def blob_key(file_id):
+    # S3 key of a deduplicated object. Blobs live outside the {id}/{name} keys of single files, so no
+    # per-file delete can remove an object other files still reference. The key is unique to the upload
+    # that stored it, so a failed or losing upload can delete its own object without racing another
+    # upload, or a delete, of the same content.
+    return f"blobs/{file_id}"
+
+def recover_failed_commit(file_id, s3_client, bucket_name, s3_key):
+    # Called when committing a new file row failed after its object was stored. The commit may have
+    # reached the database before the error (e.g. the connection dropped while waiting for the reply),
+    # so look the row up again and return it if it is there. Otherwise the object is deleted once the
+    # row is known to be missing; if the lookup fails too it is kept, since an orphaned object is
+    # safer than a row pointing at nothing.
+    try:
+        db.session.rollback()
+        existing = time_db_operation('file_commit_check', db.session.get, File, file_id)
+    except Exception:
+        return None
+    if existing is None:
+        try:
+            time_s3_operation('delete_file', s3_client.delete_object, Bucket=bucket_name, Key=s3_key)
+        except Exception:
+            pass
+    return existing
+
+def get_blob_for_update(digest):
+    # Locks the blob row so a concurrent delete cannot drop it while a reference is added
+    return time_db_operation(
+        'get_blob_for_update', Blob.query.filter_by(digest=digest).with_for_update().first
+    )
+
+def save_file_deduplicated(file_id, filename, digest, size, s3_client, bucket_name, s3_key, store, discard,
+                           content_encoding=None):
+    # Add a reference to the blob with this digest if one exists, calling discard() instead of
+    # store(); otherwise store() writes the object to s3_key, stored with content_encoding, and it
+    # is registered as a new blob. A reference takes the encoding of the blob's stored object.
+    stored = False
+    blob = get_blob_for_update(digest)
+    if blob is None:
+        # Release the lock while the object is written
+        time_db_operation('blob_rollback', db.session.rollback)
+        store()
+        stored = True
+        try:
+            blob = Blob(digest=digest, s3_key=s3_key, size=size, ref_count=1, content_encoding=content_encoding)
+            time_db_operation('blob_insert', db.session.add, blob)
+            file_data = save_file_metadata(file_id, filename, f"{bucket_name}/{s3_key}", digest, content_encoding)
+            statsd_client.incr('upload.dedup.miss')
+            return file_data
+        except Exception as e:
+            existing = recover_failed_commit(file_id, s3_client, bucket_name, s3_key)
+            if existing is not None:
+                file_data = serialize_file(existing)
+                file_metadata_cache.put(file_id, file_data)
+                statsd_client.incr('upload.dedup.miss')
+                return file_data
+            if not isinstance(e, IntegrityError):
+                raise
+            # A concurrent upload registered the same content first; reference its object instead
+            blob = get_blob_for_update(digest)
+            if blob is None:
+                raise
+    
+    blob.ref_count += 1
+    file_data = save_file_metadata(
+        file_id, filename, f"{bucket_name}/{blob.s3_key}", digest, blob.content_encoding
+    )
+    if not stored:
+        try:
+            discard()
+        except Exception as e:
+            # The file is saved; an unfinished multipart upload is left for the bucket lifecycle rule
+            extra = {'path': request.path, 'method': request.method, 'file_id': file_id}
+            logger.error(f"Error discarding duplicate upload: {str(e)}", exc_info=True, extra=extra)
+    statsd_client.incr('upload.dedup.hit')
+    statsd_client.incr('upload.dedup.bytes_saved', size)
+    return file_data
+
+def release_blobs(files):
+    # Drop one blob reference per deduplicated file in the caller's transaction. Returns the S3 keys
+    # of blobs that lost their last reference; delete them once the transaction has committed.
+    counts = Counter(file.content_sha256 for file in files if file.content_sha256)
+    if not counts:
+        return []
+    
+    blobs = time_db_operation(
+        'get_blobs_for_update', Blob.query.filter(Blob.digest.in_(counts)).with_for_update().all
+    )
+    orphaned = []
+    for blob in blobs:
+        blob.ref_count -= counts[blob.digest]
+        if blob.ref_count <= 0:
+            time_db_operation('blob_delete', db.session.delete, blob)
+            orphaned.append(blob.s3_key)
+    return orphaned
+
+_upload_executor = None
+_upload_executor_pid = None
+_upload_executor_lock = threading.Lock()
+
+def get_upload_executor():
+    # Shared executor for S3 transfers that overlap with database work; rebuilt after a fork
+    global _upload_executor, _upload_executor_pid
+    with _upload_executor_lock:
+        if _upload_executor is None or _upload_executor_pid != os.getpid():
+            _upload_executor = ThreadPoolExecutor(
+                max_workers=app.config['UPLOAD_OVERLAP_WORKERS'], thread_name_prefix='s3-upload'
+            )
+            _upload_executor_pid = os.getpid()
+        return _upload_executor
+
+def save_file_overlapped(transfer, s3_client, bucket_name, s3_key, file_id, filename, content_encoding=None):
+    # Run the S3 transfer on the upload executor while the metadata row is inserted as a pending
+    # (flushed but uncommitted) row, then commit once S3 has succeeded. If either side fails the
+    # other is undone: the row is rolled back or the uploaded object is deleted.
+    future = get_upload_executor().submit(contextvars.copy_context().run, transfer)
+    url = f"{bucket_name}/{s3_key}"
+    new_file = File(
+        id=file_id,
+        file_name=filename,
+        url=url,
+        upload_date=date.today(),
+        content_encoding=content_encoding
+    )
+    
+    try:
+        time_db_operation('file_insert', db.session.add, new_file)
+        time_db_operation('file_flush', db.session.flush)
+    except Exception:
+        try:
+            future.result()
+            time_s3_operation('delete_file', s3_client.delete_object, Bucket=bucket_name, Key=s3_key)
+        except Exception:
+            pass
+        raise
+    
+    # Raises if the transfer failed; the caller rolls back the pending row
+    future.result()
+    
+    try:
+        time_db_operation('file_commit', db.session.commit)
+    except Exception:
+        new_file = recover_failed_commit(file_id, s3_client, bucket_name, s3_key)
+        if new_file is None:
+            raise
+    replica_router.record_write()
+    
+    file_data = serialize_file(new_file)
+    file_metadata_cache.put(file_id, file_data)
+    return file_data
+
+def upload_file_streaming(start_time):
+    # Parse the multipart body as it arrives and feed the file part straight into S3
+    upload = None
+    try:
+        events = iter_request_multipart(app.config['UPLOAD_READ_CHUNK_SIZE'])
+        file_event = next(
+            (event for event in events if isinstance(event, MultipartFile) and event.name == 'file'),
+            None
+        )
+        
+        if file_event is None or file_event.filename == '':
+            extra = {
+                'path': request.path,
+                'method': request.method,
+                'remote_addr': request.remote_addr
+            }
+            if file_event is None:
+                logger.warning("Upload attempt with no file provided", extra=extra)
+            else:
+                logger.warning("Upload attempt with empty filename", extra=extra)
+            duration = (time.time() - start_time) * 1000
+            statsd_client.timing('api.upload_file.time', duration)
+            return empty_response(400)
+        
+        file_id = str(uuid.uuid4())
+        filename = secure_filename(file_event.filename)
+        
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': file_id,
+            'file_name': filename
+        }
+        logger.info(f"Processing streaming file upload", extra=extra)
+        
+        s3_client = get_s3_client()
+        bucket_name = get_bucket_name()
+        s3_key = blob_key(file_id) if app.config['UPLOAD_DEDUP'] else f"{file_id}/{filename}"
+        
+        sample = bytearray()
+        finished = False
+        extra_args = None
+        compress_level = None
+        content_encoding = None
+        if app.config['UPLOAD_COMPRESSION']:
+            # Hold back the start of the file to decide whether to compress it
+            finished = True
+            for event in events:
+                if isinstance(event, Data):
+                    sample += event.data
+                    if not event.more_data:
+                        break
+                    if len(sample) >= app.config['UPLOAD_COMPRESS_SAMPLE_SIZE']:
+                        finished = False
+                        break
+            content_type = upload_content_type(file_event.headers.get('Content-Type'), filename)
+            if should_compress(content_type, bytes(sample), finished):
+                extra_args = {'ContentType': content_type, 'ContentEncoding': 'gzip'}
+                compress_level = app.config['UPLOAD_COMPRESS_LEVEL']
+                content_encoding = 'gzip'
+                statsd_client.incr('upload.compression.compressed')
+            else:
+                statsd_client.incr('upload.compression.skipped')
+        
+        upload = S3StreamingUpload(
+            s3_client, bucket_name, s3_key,
+            app.config['UPLOAD_PART_SIZE'], app.config['UPLOAD_PART_CONCURRENCY'],
+            extra_args=extra_args, compress_level=compress_level
+        )
+        if sample:
+            upload.write(bytes(sample))
+        if not finished:
+            for event in events:
+                if isinstance(event, Data):
+                    upload.write(event.data)
+                    if not event.more_data:
+                        break
+        
+        stored = upload
+        if app.config['UPLOAD_DEDUP']:
+            # Small duplicates are never sent; larger ones abort their multipart upload unfinished
+            response = save_file_deduplicated(
+                file_id, filename, upload.sha256.hexdigest(), upload.size,
+                s3_client, bucket_name, s3_key, upload.complete, upload.abort, content_encoding
+            )
+            upload = None
+        else:
+            upload.complete()
+            upload = None
+            
+            url = f"{bucket_name}/{s3_key}"
+            response = save_file_metadata(file_id, filename, url, content_encoding=content_encoding)
+        
+        if compress_level is not None and stored.completed:
+            report_compression(stored.size, stored.stored_size)
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': file_id,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"File uploaded successfully", extra=extra)
+        
+        statsd_client.timing('api.upload_file.time', duration)
+        return jsonify(response), 201
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error uploading file: {str(e)}", exc_info=True, extra=extra)
+        
+        if upload is not None:
+            try:
+                upload.abort()
+            except Exception:
+                pass
+        try:
+            time_db_operation('file_rollback', db.session.rollback)
+        except:
+            pass
+        
+        statsd_client.timing('api.upload_file.time', duration)
+        return empty_response(400)
+
+@app.route('/v2/file/presign', methods=['POST'])
+def presign_upload():
+    start_time = time.time()
+    statsd_client.incr('api.presign_upload')
+    
+    payload = request.get_json(silent=True) or {}
+    raw_filename = payload.get('file_name')
+    upload_method = str(payload.get('method', 'PUT')).upper()
+    content_type = payload.get('content_type')
+    
+    if not isinstance(raw_filename, str) or not secure_filename(raw_filename) or upload_method not in ['PUT', 'POST']:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.warning("Bad request: invalid presigned upload request", extra=extra)
+        duration = (time.time() - start_time) * 1000
+        statsd_client.timing('api.presign_upload.time', duration)
+        return empty_response(400)
+    
+    try:
+        # Reserve an id; the File row is only written once the upload is confirmed
+        file_id = str(uuid.uuid4())
+        filename = secure_filename(raw_filename)
+        
+        s3_client = get_s3_client()
+        bucket_name = get_bucket_name()
+        s3_key = f"{file_id}/{filename}"
+        expires_in = app.config['UPLOAD_PRESIGN_EXPIRES']
+        
+        response = {
+            "id": file_id,
+            "file_name": filename,
+            "method": upload_method,
+            "expires_in": expires_in
+        }
+        
+        if upload_method == 'PUT':
+            params = {'Bucket': bucket_name, 'Key': s3_key}
+            if content_type:
+                params['ContentType'] = content_type
+            response['upload_url'] = time_s3_operation(
+                'presign_put', s3_client.generate_presigned_url,
+                'put_object', Params=params, ExpiresIn=expires_in
+            )
+        else:
+            fields = {'Content-Type': content_type} if content_type else None
+            conditions = [['content-length-range', 1, app.config['UPLOAD_PRESIGN_MAX_SIZE']]]
+            if content_type:
+                conditions.append({'Content-Type': content_type})
+            presigned_post = time_s3_operation(
+                'presign_post', s3_client.generate_presigned_post,
+                bucket_name, s3_key, Fields=fields, Conditions=conditions, ExpiresIn=expires_in
+            )
+            response['upload_url'] = presigned_post['url']
+            response['fields'] = presigned_post['fields']
+        
+        # Only an id handed out here can be completed, and only once
+        reservation = UploadReservation(
+            id=file_id,
+            file_name=filename,
+            expires_at=datetime.now() + timedelta(seconds=app.config['UPLOAD_RESERVATION_TTL'])
+        )
+        time_db_operation('upload_reservation_insert', db.session.add, reservation)
+        time_db_operation('upload_reservation_commit', db.session.commit)
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': file_id,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"Presigned upload created", extra=extra)
+        
+        statsd_client.timing('api.presign_upload.time', duration)
+        return jsonify(response), 201
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error creating presigned upload: {str(e)}", exc_info=True, extra=extra)
+        statsd_client.timing('api.presign_upload.time', duration)
+        return empty_response(500)
+
+@app.route('/v2/file/<string:id>/complete', methods=['POST'])
+def complete_upload(id):
+    start_time = time.time()
+    statsd_client.incr('api.complete_upload')
+    
+    payload = request.get_json(silent=True) or {}
+    raw_filename = payload.get('file_name')
     
-    # Check if file is empty
-    if file.filename == '':
+    try:
+        valid_id = str(uuid.UUID(id)) == id
+    except ValueError:
+        valid_id = False
+    
+    if not valid_id or not isinstance(raw_filename, str) or not secure_filename(raw_filename):
         extra = {
             'path': request.path,
             'method': request.method,
-            'remote_addr': request.remote_addr
+            'remote_addr': request.remote_addr,
+            'file_id': id
         }
-        logger.warning("Upload attempt with empty filename", extra=extra)
-        response = app.response_class(
-            response='',
-            status=400,
-            headers = {
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'X-Content-Type-Options': 'nosniff'
-            }
-        )
+        logger.warning("Bad request: invalid upload completion request", extra=extra)
         duration = (time.time() - start_time) * 1000
-        statsd_client.timing('api.upload_file.time', duration)
-        return response
+        statsd_client.timing('api.complete_upload.time', duration)
+        return empty_response(400)
     
     try:
-        # Generate secure filename and unique ID
-        file_id = str(uuid.uuid4())
-        filename = secure_filename(file.filename)
+        filename = secure_filename(raw_filename)
+        bucket_name = get_bucket_name()
+        s3_key = f"{id}/{filename}"
         
         extra = {
             'path': request.path,
             'method': request.method,
             'remote_addr': request.remote_addr,
-            'file_id': file_id,
+            'file_id': id,
             'file_name': filename
         }
-        logger.info(f"Processing file upload", extra=extra)
+        logger.info(f"Confirming presigned upload", extra=extra)
         
-        # Get S3 client and bucket name
+        # Only record the file once S3 confirms the object exists
         s3_client = get_s3_client()
-        bucket_name = get_bucket_name()
-        
-        # Define S3 path/key
-        s3_key = f"{file_id}/{filename}"
-        
-        # Upload to S3 with timing
-        time_s3_operation('upload_file', s3_client.upload_fileobj, file, bucket_name, s3_key)
-        
-        # Create URL
-        url = f"{bucket_name}/{s3_key}"
+        try:
+            time_s3_operation('head_object', s3_client.head_object, Bucket=bucket_name, Key=s3_key)
+        except s3_client_error():
+            logger.warning(f"Uploaded object not found", extra=extra)
+            duration = (time.time() - start_time) * 1000
+            statsd_client.timing('api.complete_upload.time', duration)
+            return empty_response(400)
         
-        # Store metadata in database
-        new_file = File(
-            id=file_id,
-            file_name=filename,
-            url=url,
-            upload_date=date.today()
+        # Consume the reservation in the same transaction as the File insert, so an id that was never
+        # presigned, has expired or was already completed (and possibly deleted since) is refused
+        consume = UploadReservation.__table__.delete().where(
+            UploadReservation.id == id,
+            UploadReservation.file_name == filename,
+            UploadReservation.expires_at >= datetime.now()
         )
+        result = time_db_operation('upload_reservation_consume', db.session.execute, consume)
+        if result.rowcount != 1:
+            time_db_operation('file_rollback', db.session.rollback)
+            logger.warning(f"No pending reservation for upload", extra=extra)
+            statsd_client.incr('api.complete_upload.unreserved')
+            duration = (time.time() - start_time) * 1000
+            statsd_client.timing('api.complete_upload.time', duration)
+            return empty_response(400)
         
-        time_db_operation('file_insert', db.session.add, new_file)
-        time_db_operation('file_commit', db.session.commit)
-        
-        # Return success response
-        response = {
-            "file_name": filename,
-            "id": file_id,
-            "url": url,
-            "upload_date": new_file.upload_date.strftime("%Y-%m-%d")
-        }
+        response = save_file_metadata(id, filename, f"{bucket_name}/{s3_key}")
         
         duration = (time.time() - start_time) * 1000
         extra = {
             'path': request.path,
             'method': request.method,
             'remote_addr': request.remote_addr,
-            'file_id': file_id,
+            'file_id': id,
             'duration_ms': f"{duration:.2f}"
         }
         logger.info(f"File uploaded successfully", extra=extra)
         
-        statsd_client.timing('api.upload_file.time', duration)
+        statsd_client.timing('api.complete_upload.time', duration)
         return jsonify(response), 201
-        
+    
     except Exception as e:
         duration = (time.time() - start_time) * 1000
         extra = {
             'path': request.path,
             'method': request.method,
             'remote_addr': request.remote_addr,
+            'file_id': id,
             'duration_ms': f"{duration:.2f}"
         }
-        logger.error(f"Error uploading file: {str(e)}", exc_info=True, extra=extra)
+        logger.error(f"Error completing upload: {str(e)}", exc_info=True, extra=extra)
         
         try:
             time_db_operation('file_rollback', db.session.rollback)
         except:
             pass
-            
-        response = app.response_class(
-            response='',
-            status=400,
-            headers = {
-                'Cache-Control': 'no-cache, no-store, must-revalidate',
-                'Pragma': 'no-cache',
-                'X-Content-Type-Options': 'nosniff'
-            }
-        )
-        statsd_client.timing('api.upload_file.time', duration)
-        return response
+        
+        statsd_client.timing('api.complete_upload.time', duration)
+        return empty_response(400)
 
 @app.route('/v1/file/<string:id>', methods=['GET'])
 def get_file(id):
@@ -557,9 +2946,16 @@ def get_file(id):
         }
         logger.info(f"Retrieving file", extra=extra)
         
-        file = time_db_operation('get_file', File.query.get, id)
+        found, file_data = file_metadata_cache.get(id)
+        if not found:
+            # A miss on the replica is retried on the primary in case the row was just written
+            file = read_db_operation(
+                'get_file', live_files().filter(File.id == id).first, retry_on_primary=lambda file: file is None
+            )
+            file_data = serialize_file(file) if file else None
+            file_metadata_cache.put(id, file_data)
         
-        if not file:
+        if not file_data:
             extra = {
                 'path': request.path,
                 'method': request.method,
@@ -582,12 +2978,7 @@ def get_file(id):
             return response
         
         # Return file metadata
-        response = {
-            "file_name": file.file_name,
-            "id": file.id,
-            "url": file.url,
-            "upload_date": file.upload_date.strftime("%Y-%m-%d")
-        }
+        response = file_data
         
         duration = (time.time() - start_time) * 1000
         extra = {
@@ -625,6 +3016,320 @@ def get_file(id):
         statsd_client.timing('api.get_file.time', duration)
         return response
 
+def requested_s3_range():
+    # The Range header to forward to S3, or None to send the whole object. Only a single byte range
+    # is forwarded; multiple ranges and If-Range dates or weak tags fall back to the full content.
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and not if_range.startswith('"'):
+        return None
+    return byte_range.to_header()
+
+def gunzip_chunks(chunks, chunk_size):
+    # Decompress a gzip stream for clients that do not accept gzip, yielding at most chunk_size
+    # bytes at a time however well the content compressed
+    decompressor = zlib.decompressobj(31)
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, chunk_size)
+            chunk = decompressor.unconsumed_tail
+            if data:
+                yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+@app.route('/v1/file/<string:id>/content', methods=['GET'])
+def download_file(id):
+    start_time = time.time()
+    statsd_client.incr('api.download_file')
+    
+    try:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': id
+        }
+        logger.info(f"Downloading file", extra=extra)
+        
+        found, file_data = file_metadata_cache.get(id)
+        if not found:
+            file = read_db_operation(
+                'get_file', live_files().filter(File.id == id).first, retry_on_primary=lambda file: file is None
+            )
+            file_data = serialize_file(file) if file else None
+            file_metadata_cache.put(id, file_data)
+        
+        if not file_data:
+            logger.warning(f"File not found for download", extra=extra)
+            duration = (time.time() - start_time) * 1000
+            statsd_client.timing('api.download_file.time', duration)
+            return empty_response(404)
+        
+        s3_client = get_s3_client()
+        bucket_name = get_bucket_name()
+        params = {'Bucket': bucket_name, 'Key': s3_key_for(file_data['url'], bucket_name)}
+        accepts_gzip = request.accept_encodings['gzip'] > 0
+        if request.headers.get('If-None-Match'):
+            # S3 compares against the object's ETag and answers 304 itself. Decompressed content is
+            # tagged with the weak form of that ETag, which If-None-Match matches as well.
+            params['IfNoneMatch'] = request.headers['If-None-Match'].replace('W/', '')
+        byte_range = requested_s3_range()
+        if byte_range:
+            params['Range'] = byte_range
+            if request.headers.get('If-Range'):
+                params['IfMatch'] = request.headers['If-Range']
+        
+        try:
+            try:
+                s3_object = time_s3_operation('get_object', s3_client.get_object, **params)
+            except s3_client_error() as e:
+                if client_error_status(e) != 412 or 'IfMatch' not in params:
+                    raise
+                # If-Range no longer matches: the object changed, so send all of it
+                params.pop('Range')
+                params.pop('IfMatch')
+                s3_object = time_s3_operation('get_object', s3_client.get_object, **params)
+            
+            if s3_object.get('ContentEncoding') == 'gzip' and not accepts_gzip and 'ContentRange' in s3_object:
+                # A byte range of compressed content cannot be decompressed on its own; send it all
+                s3_object['Body'].close()
+                params.pop('Range')
+                params.pop('IfMatch', None)
+                s3_object = time_s3_operation('get_object', s3_client.get_object, **params)
+        except s3_client_error() as e:
+            status = client_error_status(e)
+            if status == 304:
+                etag = e.response['ResponseMetadata'].get('HTTPHeaders', {}).get('etag')
+                if etag and not accepts_gzip and f'W/{etag}' in request.headers['If-None-Match']:
+                    etag = f'W/{etag}'
+                response = app.response_class(
+                    response='',
+                    status=304,
+                    headers={
+                        'ETag': etag or request.headers['If-None-Match'],
+                        'Cache-Control': 'no-cache',
+                        'X-Content-Type-Options': 'nosniff'
+                    }
+                )
+            elif status == 416:
+                response = empty_response(416)
+            elif status == 404:
+                logger.warning(f"Object missing for file", extra=extra)
+                response = empty_response(404)
+            else:
+                raise
+            duration = (time.time() - start_time) * 1000
+            statsd_client.timing('api.download_file.time', duration)
+            return response
+        
+        # Stream the body a chunk at a time so memory per download stays at DOWNLOAD_CHUNK_SIZE
+        body = s3_object['Body']
+        chunks = body.iter_chunks(app.config['DOWNLOAD_CHUNK_SIZE'])
+        headers = {
+            'Content-Type': s3_object.get('ContentType') or 'application/octet-stream',
+            'Content-Length': str(s3_object['ContentLength']),
+            'Content-Disposition': f'attachment; filename="{file_data["file_name"]}"',
+            'ETag': s3_object['ETag'],
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'no-cache',
+            'X-Content-Type-Options': 'nosniff'
+        }
+        if s3_object.get('ContentEncoding') == 'gzip':
+            headers['Vary'] = 'Accept-Encoding'
+            if accepts_gzip:
+                headers['Content-Encoding'] = 'gzip'
+                statsd_client.incr('api.download_file.gzip')
+            else:
+                # Decompressed on the fly, so the length is unknown and ranges are not offered
+                chunks = gunzip_chunks(chunks, app.config['DOWNLOAD_CHUNK_SIZE'])
+                del headers['Content-Length']
+                headers['ETag'] = f"W/{s3_object['ETag']}"
+                headers['Accept-Ranges'] = 'none'
+                statsd_client.incr('api.download_file.decompressed')
+        response = app.response_class(
+            chunks,
+            status=206 if 'ContentRange' in s3_object else 200,
+            headers=headers
+        )
+        if 'ContentRange' in s3_object:
+            response.headers['Content-Range'] = s3_object['ContentRange']
+        # Also releases the S3 connection when the body is never read, e.g. for HEAD. Not combined
+        # with direct_passthrough, which would skip close callbacks.
+        response.call_on_close(body.close)
+        
+        duration = (time.time() - start_time) * 1000
+        extra['duration_ms'] = f"{duration:.2f}"
+        logger.info(f"File download started", extra=extra)
+        
+        statsd_client.timing('api.download_file.time', duration)
+        return response
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'file_id': id,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error downloading file: {str(e)}", exc_info=True, extra=extra)
+        statsd_client.timing('api.download_file.time', duration)
+        return empty_response(500)
+
+def read_id_list(max_ids):
+    # Returns the de-duplicated "ids" list from a JSON body, or None if it is invalid
+    payload = request.get_json(silent=True)
+    ids = payload.get('ids') if isinstance(payload, dict) else None
+    if not isinstance(ids, list) or not ids or len(ids) > max_ids:
+        return None
+    if not all(isinstance(file_id, str) and file_id for file_id in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+@app.route('/v1/files/lookup', methods=['POST'])
+def lookup_files():
+    start_time = time.time()
+    statsd_client.incr('api.lookup_files')
+    
+    ids = read_id_list(app.config['FILE_BATCH_MAX_IDS'])
+    if ids is None:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.warning("Bad request: invalid batch lookup request", extra=extra)
+        duration = (time.time() - start_time) * 1000
+        statsd_client.timing('api.lookup_files.time', duration)
+        return empty_response(400)
+    
+    try:
+        results = {}
+        uncached = []
+        for file_id in ids:
+            found, file_data = file_metadata_cache.get(file_id)
+            if found:
+                results[file_id] = file_data
+            else:
+                uncached.append(file_id)
+        
+        if uncached:
+            # One IN (...) query for everything the cache could not answer
+            files = read_db_operation(
+                'get_files_batch', live_files().filter(File.id.in_(uncached)).all,
+                retry_on_primary=lambda files: len(files) < len(uncached)
+            )
+            for file in files:
+                results[file.id] = serialize_file(file)
+            for file_id in uncached:
+                file_metadata_cache.put(file_id, results.get(file_id))
+        
+        response = {
+            "files": [results[file_id] for file_id in ids if results.get(file_id)],
+            "missing": [file_id for file_id in ids if not results.get(file_id)]
+        }
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"Batch lookup returned {len(response['files'])} of {len(ids)} files", extra=extra)
+        
+        statsd_client.timing('api.lookup_files.time', duration)
+        return jsonify(response), 200
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error looking up files: {str(e)}", exc_info=True, extra=extra)
+        statsd_client.timing('api.lookup_files.time', duration)
+        return empty_response(500)
+
+@app.route('/v1/files', methods=['GET'])
+def list_files():
+    start_time = time.time()
+    statsd_client.incr('api.list_files')
+    
+    try:
+        limit = int(request.args.get('limit', app.config['FILE_LIST_DEFAULT_LIMIT']))
+        if limit < 1 or limit > app.config['FILE_LIST_MAX_LIMIT']:
+            raise ValueError(f"limit must be between 1 and {app.config['FILE_LIST_MAX_LIMIT']}")
+        date_from = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+        date_to = date.fromisoformat(request.args['to']) if 'to' in request.args else None
+        cursor = decode_list_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError as e:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.warning(f"Bad request: invalid file listing parameters: {str(e)}", extra=extra)
+        duration = (time.time() - start_time) * 1000
+        statsd_client.timing('api.list_files.time', duration)
+        return empty_response(400)
+    
+    try:
+        query = live_files()
+        if date_from:
+            query = query.filter(File.upload_date >= date_from)
+        if date_to:
+            query = query.filter(File.upload_date <= date_to)
+        if cursor:
+            # Seek past the last row of the previous page instead of using OFFSET, written so
+            # the (upload_date, id) index bounds the scan on every database
+            last_date, last_id = cursor
+            query = query.filter(
+                File.upload_date >= last_date,
+                db.or_(File.upload_date > last_date, File.id > last_id)
+            )
+        
+        # Fetch one extra row to learn whether another page exists
+        files = read_db_operation(
+            'list_files', query.order_by(File.upload_date, File.id).limit(limit + 1).all
+        )
+        
+        response = {
+            "files": [serialize_file(file) for file in files[:limit]],
+            "next_cursor": encode_list_cursor(files[limit - 1]) if len(files) > limit else None
+        }
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"Listed {len(response['files'])} files", extra=extra)
+        
+        statsd_client.timing('api.list_files.time', duration)
+        return jsonify(response), 200
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error listing files: {str(e)}", exc_info=True, extra=extra)
+        statsd_client.timing('api.list_files.time', duration)
+        return empty_response(500)
+
 @app.route('/v1/file/<string:id>', methods=['DELETE'])
 def delete_file(id):
     start_time = time.time()
@@ -653,9 +3358,22 @@ def delete_file(id):
         }
         logger.info(f"Deleting file", extra=extra)
         
-        file = time_db_operation('get_file_for_delete', File.query.get, id)
+        tombstoned = False
+        file = None
+        if app.config['FILE_DELETE_ASYNC']:
+            # A single conditional UPDATE; the reaper deletes the object and the row later
+            statement = (
+                File.__table__.update()
+                .where(File.id == id, File.deleted_at.is_(None))
+                .values(deleted_at=datetime.now())
+            )
+            result = time_db_operation('file_tombstone', db.session.execute, statement)
+            time_db_operation('file_tombstone_commit', db.session.commit)
+            tombstoned = result.rowcount > 0
+        else:
+            file = time_db_operation('get_file_for_delete', live_files().filter(File.id == id).first)
         
-        if not file:
+        if not file and not tombstoned:
             extra = {
                 'path': request.path,
                 'method': request.method,
@@ -677,19 +3395,54 @@ def delete_file(id):
             statsd_client.timing('api.delete_file.time', duration)
             return response
         
+        if tombstoned:
+            replica_router.record_write()
+            file_metadata_cache.invalidate(id)
+            statsd_client.incr('api.delete_file.tombstoned')
+            
+            duration = (time.time() - start_time) * 1000
+            extra['duration_ms'] = f"{duration:.2f}"
+            logger.info(f"File tombstoned for deletion", extra=extra)
+            statsd_client.timing('api.delete_file.time', duration)
+            return '', 204
+        
         # Delete from S3 with timing
         s3_client = get_s3_client()
         bucket_name = get_bucket_name()
         
-        # Extract the key from the URL
-        s3_key = file.url.replace(f"{bucket_name}/", "", 1)
-        
-        # Delete the object from S3
-        time_s3_operation('delete_file', s3_client.delete_object, Bucket=bucket_name, Key=s3_key)
+        if file.content_sha256:
+            # Lock the row and check it is still there, so concurrent deletes of the same file
+            # release its blob reference only once
+            file = time_db_operation(
+                'get_file_for_delete_for_update', live_files().filter(File.id == id).with_for_update().first
+            )
+            if file is None:
+                time_db_operation('file_delete_rollback', db.session.rollback)
+                logger.warning(f"File not found for deletion", extra=extra)
+                duration = (time.time() - start_time) * 1000
+                statsd_client.timing('api.delete_file.time', duration)
+                return empty_response(404)
+            # Deduplicated content is only removed from S3 with its last reference
+            orphaned = release_blobs([file])
+        else:
+            # Extract the key from the URL
+            s3_key = s3_key_for(file.url, bucket_name)
+            
+            # Delete the object from S3
+            time_s3_operation('delete_file', s3_client.delete_object, Bucket=bucket_name, Key=s3_key)
+            orphaned = []
         
         # Delete from database with timing
         time_db_operation('file_delete', db.session.delete, file)
         time_db_operation('file_delete_commit', db.session.commit)
+        replica_router.record_write()
+        file_metadata_cache.invalidate(id)
+        
+        for s3_key in orphaned:
+            try:
+                time_s3_operation('delete_file', s3_client.delete_object, Bucket=bucket_name, Key=s3_key)
+            except Exception as e:
+                logger.error(f"Error deleting unreferenced blob {s3_key}: {str(e)}", exc_info=True, extra=extra)
         
         duration = (time.time() - start_time) * 1000
         extra = {
@@ -733,6 +3486,128 @@ def delete_file(id):
         statsd_client.timing('api.delete_file.time', duration)
         return response
 
+@app.route('/v1/files/delete', methods=['POST'])
+def bulk_delete_files():
+    start_time = time.time()
+    statsd_client.incr('api.bulk_delete_files')
+    
+    ids = read_id_list(app.config['FILE_BULK_DELETE_MAX_IDS'])
+    if ids is None:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.warning("Bad request: invalid bulk delete request", extra=extra)
+        duration = (time.time() - start_time) * 1000
+        statsd_client.timing('api.bulk_delete_files.time', duration)
+        return empty_response(400)
+    
+    try:
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr
+        }
+        logger.info(f"Bulk deleting {len(ids)} files", extra=extra)
+        
+        files = time_db_operation('get_files_for_bulk_delete', live_files().filter(File.id.in_(ids)).all)
+        
+        s3_client = get_s3_client()
+        bucket_name = get_bucket_name()
+        if app.config['FILE_DELETE_ASYNC']:
+            # Tombstoned files keep their objects until the reaper removes them
+            tombstoned_ids = [file.id for file in files]
+            shared = []
+            keys = {}
+        else:
+            # Deduplicated files share objects, which are deleted below once unreferenced
+            tombstoned_ids = []
+            shared = [file for file in files if file.content_sha256]
+            keys = {file.id: s3_key_for(file.url, bucket_name) for file in files if not file.content_sha256}
+        s3_errors = delete_s3_objects(s3_client, bucket_name, list(dict.fromkeys(keys.values())))
+        
+        results = {file_id: {"id": file_id, "status": "not_found"} for file_id in ids}
+        deleted_ids = tombstoned_ids + [file.id for file in shared]
+        for file_id, key in keys.items():
+            if key in s3_errors:
+                results[file_id] = {"id": file_id, "status": "error", "error": s3_errors[key]}
+            else:
+                deleted_ids.append(file_id)
+        
+        orphaned = []
+        if deleted_ids:
+            # Remove every row whose object is gone in a single transaction
+            try:
+                if tombstoned_ids:
+                    statement = (
+                        File.__table__.update()
+                        .where(File.id.in_(tombstoned_ids), File.deleted_at.is_(None))
+                        .values(deleted_at=datetime.now())
+                    )
+                    time_db_operation('file_bulk_tombstone', db.session.execute, statement)
+                else:
+                    if shared:
+                        # Lock the rows and keep only those still there, so concurrent deletes of the
+                        # same file release its blob reference only once
+                        locked = time_db_operation(
+                            'get_files_for_bulk_delete_for_update',
+                            live_files().filter(File.id.in_([file.id for file in shared])).with_for_update().all
+                        )
+                        gone = {file.id for file in shared} - {file.id for file in locked}
+                        deleted_ids = [file_id for file_id in deleted_ids if file_id not in gone]
+                        orphaned = release_blobs(locked)
+                    statement = File.__table__.delete().where(File.id.in_(deleted_ids))
+                    time_db_operation('file_bulk_delete', db.session.execute, statement)
+                time_db_operation('file_bulk_delete_commit', db.session.commit)
+                replica_router.record_write()
+            except Exception as e:
+                logger.error(f"Error deleting file rows: {str(e)}", exc_info=True, extra=extra)
+                try:
+                    time_db_operation('file_bulk_delete_rollback', db.session.rollback)
+                except:
+                    pass
+                for file_id in deleted_ids:
+                    results[file_id] = {"id": file_id, "status": "error", "error": "database error"}
+                deleted_ids = []
+                orphaned = []
+        
+        blob_errors = delete_s3_objects(s3_client, bucket_name, orphaned)
+        for key, error in blob_errors.items():
+            logger.error(f"Error deleting unreferenced blob {key}: {error}", extra=extra)
+        
+        for file_id in deleted_ids:
+            results[file_id] = {"id": file_id, "status": "deleted"}
+            file_metadata_cache.invalidate(file_id)
+        
+        statsd_client.incr('api.bulk_delete_files.deleted', len(deleted_ids))
+        if s3_errors:
+            statsd_client.incr('api.bulk_delete_files.s3_errors', len(s3_errors))
+        
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.info(f"Bulk delete removed {len(deleted_ids)} of {len(ids)} files", extra=extra)
+        
+        statsd_client.timing('api.bulk_delete_files.time', duration)
+        return jsonify({"results": [results[file_id] for file_id in ids]}), 200
+    
+    except Exception as e:
+        duration = (time.time() - start_time) * 1000
+        extra = {
+            'path': request.path,
+            'method': request.method,
+            'remote_addr': request.remote_addr,
+            'duration_ms': f"{duration:.2f}"
+        }
+        logger.error(f"Error bulk deleting files: {str(e)}", exc_info=True, extra=extra)
+        statsd_client.timing('api.bulk_delete_files.time', duration)
+        return empty_response(500)
+
 @app.errorhandler(405)
 def method_not_allowed(e):
     extra = {
@@ -765,9 +3640,43 @@ def block_options_request():
         
         return method_not_allowed(None)
 
+@app.before_request
+def start_handler_span():
+    # Registered last so the span covers only the route handler
+    trace = current_trace()
+    if trace is not None:
+        trace.handler_start = time.perf_counter()
+        _span_depth.set(1)
+
+@app.after_request
+def end_handler_span(response):
+    trace = current_trace()
+    if trace is not None and trace.handler_start is not None:
+        trace.add('handler', 0, trace.handler_start, time.perf_counter())
+        trace.handler_start = None
+        _span_depth.set(0)
+    return response
+
+@app.route('/readyz', methods=['GET'])
+def readiness_check():
+    # 200 once this process has warmed up its database and S3 connections, 503 until then
+    ready = warm_up_state.ready()
+    response = jsonify({"ready": ready, "components": warm_up_state.snapshot()})
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    return response
+
+@app.route('/debug/slow-requests', methods=['GET'])
+def debug_slow_requests():
+    if not app.config['TRACE_DEBUG_ENDPOINT']:
+        return empty_response(404)
+    return jsonify({"requests": slow_requests.snapshot()}), 200
+
 if __name__ == '__main__':
     try:
         bootstrap_db()
+        start_background_jobs()
+        start_warm_up()
         extra = {'path': '', 'method': '', 'remote_addr': ''}
         logger.info("Application starting up", extra=extra)
         
@@ -0,0 +1,60 @@
+# Measure formatter throughput in records per second for JsonFormatter and FastJsonFormatter
+# using the records a typical GET /v1/file/<id> produces.
+#
+#   TESTING=True python benchmarks/bench_log_formatter.py --records 200000
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TESTING', 'True')
+
+from app import JsonFormatter, FastJsonFormatter, LogSampler
+
+REQUEST_EXTRA = {'path': '/v1/file/0b4c5d1e', 'method': 'GET', 'remote_addr': '10.0.1.25'}
+DB_EXTRA = dict(REQUEST_EXTRA, operation='db.get_file', duration_ms='1.42')
+
+
+def make_record(message, extra):
+    record = logging.LogRecord('webapp', logging.INFO, __file__, 0, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def request_records():
+    return [
+        make_record("Request received", REQUEST_EXTRA),
+        make_record("Retrieving file", dict(REQUEST_EXTRA, file_id='0b4c5d1e')),
+        make_record("Database operation get_file completed", DB_EXTRA),
+        make_record("File retrieved successfully", dict(REQUEST_EXTRA, duration_ms='2.10')),
+        make_record("Response sent", dict(REQUEST_EXTRA, status_code=200)),
+    ]
+
+
+def bench_formatter(formatter, records, count):
+    start = time.perf_counter()
+    for i in range(count):
+        record = records[i % len(records)]
+        formatter.format(record)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Log formatter throughput benchmark')
+    parser.add_argument('--records', type=int, default=200000)
+    args = parser.parse_args()
+
+    records = request_records()
+    for name, formatter in [('JsonFormatter', JsonFormatter()), ('FastJsonFormatter', FastJsonFormatter())]:
+        rate = bench_formatter(formatter, records, args.records)
+        print(f"{name:<20} {rate:12,.0f} records/s")
+
+    sampler = LogSampler({"Database operation * completed": 0.1})
+    kept = sum(sampler.filter(records[i % len(records)]) for i in range(args.records))
+    print(f"{'sampled (db 10%)':<20} {kept / args.records:12.1%} of records kept")
+
+
+if __name__ == '__main__':
+    main()
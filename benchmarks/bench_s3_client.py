@@ -0,0 +1,68 @@
+# Compare building a boto3 S3 client per request with the pooled client from get_s3_client().
+#
+# Without --endpoint-url the S3 call is answered by botocore's Stubber, so the numbers show
+# client construction cost only. Point --endpoint-url at a local S3 stand-in (MinIO, moto
+# server) to include connection setup as well.
+#
+#   TESTING=True python benchmarks/bench_s3_client.py --requests 200
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TESTING', 'True')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+from botocore.stub import Stubber
+
+import app as webapp
+
+
+def head_object(client, bucket, key, stubbed):
+    if not stubbed:
+        return client.head_object(Bucket=bucket, Key=key)
+    with Stubber(client) as stubber:
+        stubber.add_response('head_object', {'ContentLength': 1}, {'Bucket': bucket, 'Key': key})
+        return client.head_object(Bucket=bucket, Key=key)
+
+
+def run(label, get_client, requests, bucket, key, stubbed):
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        head_object(get_client(), bucket, key, stubbed)
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    mean = sum(durations) / len(durations)
+    p50 = durations[len(durations) // 2]
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    print(f"{label:<20} mean {mean:8.3f} ms   p50 {p50:8.3f} ms   p99 {p99:8.3f} ms")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description='S3 client creation benchmark')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--endpoint-url', default=None)
+    parser.add_argument('--bucket', default='benchmark-bucket')
+    parser.add_argument('--key', default='benchmark/object')
+    args = parser.parse_args()
+
+    stubbed = args.endpoint_url is None
+    webapp.app.config['S3_ENDPOINT_URL'] = args.endpoint_url
+
+    def per_request_client():
+        return boto3.client('s3', endpoint_url=args.endpoint_url)
+
+    per_request = run('per-request client', per_request_client, args.requests, args.bucket, args.key, stubbed)
+    pooled = run('pooled client', webapp.get_s3_client, args.requests, args.bucket, args.key, stubbed)
+    print(f"speedup: {per_request / pooled:.1f}x")
+    print(webapp.s3_client_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Measure how long the app takes to import and to start serving, against stubbed local services.
+#
+# AWS endpoints (S3 and CloudWatch Logs) point at a local stub that answers every call after
+# --aws-delay seconds, to show that a slow or unreachable AWS no longer holds back startup.
+# The database is a throwaway SQLite file.
+#
+#   python benchmarks/bench_startup.py --imports 5 --aws-delay 3
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT_SCRIPT = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app\n"
+    "print((time.perf_counter() - start) * 1000, 'boto3' in sys.modules or 'botocore' in sys.modules)\n"
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_aws_stub(delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            time.sleep(delay)
+            body = b'{}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-amz-json-1.1')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_PUT = do_GET = do_HEAD = do_POST
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def app_environment(stub_url, workdir):
+    env = dict(os.environ)
+    env.pop('TESTING', None)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        LOG_FILE=os.path.join(workdir, 'app.log'),
+        S3_ENDPOINT_URL=stub_url,
+        S3_BUCKET_NAME='startup-bench',
+        AWS_ENDPOINT_URL_CLOUDWATCH_LOGS=stub_url,
+        AWS_ACCESS_KEY_ID='stub',
+        AWS_SECRET_ACCESS_KEY='stub',
+        AWS_DEFAULT_REGION='us-east-1',
+        S3_STATS_INTERVAL='0'
+    )
+    return env
+
+
+def measure_imports(env, runs):
+    timings = []
+    aws_loaded = False
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout.split()
+        timings.append(float(output[-2]))
+        aws_loaded = aws_loaded or output[-1] == 'True'
+    return timings, aws_loaded
+
+
+def get(port, path):
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    except (OSError, http.client.HTTPException):
+        return None, b''
+
+
+def measure_serving(env, timeout):
+    port = free_port()
+    env = dict(env, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS='1')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    milestones = {}
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline and len(milestones) < 3:
+            status, body = get(port, '/readyz')
+            now = (time.perf_counter() - start) * 1000
+            if status is not None:
+                milestones.setdefault('first response', now)
+            if status == 200:
+                milestones.setdefault('ready', now)
+                if json.loads(body)['components'].get('cloudwatch'):
+                    milestones.setdefault('cloudwatch attached', now)
+            time.sleep(0.01)
+        return milestones
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time benchmark')
+    parser.add_argument('--imports', type=int, default=5, help='fresh interpreters to time the import in')
+    parser.add_argument('--aws-delay', type=float, default=3, help='seconds the AWS stub takes per call')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    stub = start_aws_stub(args.aws_delay)
+    stub_url = f'http://127.0.0.1:{stub.server_address[1]}'
+    with tempfile.TemporaryDirectory() as workdir:
+        env = app_environment(stub_url, workdir)
+
+        timings, aws_loaded = measure_imports(env, args.imports)
+        print(
+            f"import app: median {statistics.median(timings):7.1f} ms   min {min(timings):7.1f} ms   "
+            f"boto3/botocore imported: {aws_loaded}"
+        )
+
+        milestones = measure_serving(env, args.timeout)
+        print(f"gunicorn with AWS answering after {args.aws_delay:.1f} s:")
+        for name in ('first response', 'ready', 'cloudwatch attached'):
+            value = f"{milestones[name]:8.1f} ms" if name in milestones else '    not reached'
+            print(f"  {name:<20} {value}")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Show how requests/sec scale with the number of gunicorn workers.
+#
+# Starts gunicorn with gunicorn.conf.py against a throwaway SQLite file for each worker count,
+# then drives GET /v1/file/<id> from several client processes with keep-alive connections.
+#
+#   python benchmarks/load_test.py --workers 1 2 4 --duration 10
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/readyz')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not become ready")
+
+
+def seed_file(database_path):
+    # The gunicorn master creates the schema before forking; add one row for the GET workload
+    file_id = str(uuid.uuid4())
+    connection = sqlite3.connect(database_path)
+    connection.execute(
+        "INSERT INTO files (id, file_name, url, upload_date) VALUES (?, ?, ?, date('now'))",
+        (file_id, 'load.txt', f'bucket/{file_id}/load.txt')
+    )
+    connection.commit()
+    connection.close()
+    return file_id
+
+
+def client_loop(port, path, duration, threads):
+    # Runs in a separate process so the load generator is not limited by one GIL
+    from concurrent.futures import ThreadPoolExecutor
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        completed = errors = 0
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status == 200:
+                    completed += 1
+                else:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        return completed, errors
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: worker(), range(threads)))
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def run(workers, threads, duration, clients, client_threads):
+    port = free_port()
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    database.close()
+    env = dict(
+        os.environ,
+        TESTING='True',
+        DATABASE_URL=f'sqlite:///{database.name}',
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        HEALTH_CHECK_CACHE_TTL='1',
+        S3_STATS_INTERVAL='0'
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(port)
+        path = f'/v1/file/{seed_file(database.name)}'
+        with ProcessPoolExecutor(max_workers=clients) as executor:
+            futures = [executor.submit(client_loop, port, path, duration, client_threads) for _ in range(clients)]
+            results = [future.result() for future in futures]
+        completed = sum(r[0] for r in results)
+        errors = sum(r[1] for r in results)
+        return completed / duration, errors
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+        os.unlink(database.name)
+
+
+def main():
+    cores = multiprocessing.cpu_count()
+    default_workers = sorted({1, 2, 4, cores} & set(range(1, cores + 1))) or [1]
+
+    parser = argparse.ArgumentParser(description='Gunicorn worker scaling load test')
+    parser.add_argument('--workers', type=int, nargs='+', default=default_workers)
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=max(2, cores), help='client processes')
+    parser.add_argument('--client-threads', type=int, default=8, help='connections per client process')
+    args = parser.parse_args()
+
+    print(f"{cores} cores available")
+    baseline = None
+    for workers in args.workers:
+        rate, errors = run(workers, args.threads, args.duration, args.clients, args.client_threads)
+        baseline = baseline or rate
+        print(f"workers={workers:<3} {rate:10.1f} req/s   {rate / baseline:5.2f}x   errors={errors}")
+
+
+if __name__ == '__main__':
+    main()
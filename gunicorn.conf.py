@@ -0,0 +1,36 @@
+# Gunicorn settings for serving the webapp in production:
+#   gunicorn --config gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# On SIGTERM workers stop accepting connections and get this long to finish in-flight
+# requests, including large uploads, before they are killed
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '300'))
+
+# Import the app once in the master so workers fork with it already loaded. The master creates
+# missing tables once before forking; connection, S3 and CloudWatch setup happens in the background
+# in each worker and /readyz reports when it is done. Because the master holds the imported code,
+# a HUP only restarts workers on the old code; deploying new code needs a full restart.
+preload_app = True
+
+
+def on_starting(server):
+    from app import bootstrap_db
+    bootstrap_db()
+
+
+def post_fork(server, worker):
+    from app import init_worker
+    init_worker()
+
+
+def worker_exit(server, worker):
+    from app import shutdown_worker
+    shutdown_worker()
@@ -0,0 +1,168 @@
+import hashlib
+import io
+import re
+import threading
+import uuid
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+
+def client_error(code, status, operation, headers=None):
+    return ClientError(
+        {
+            'Error': {'Code': code, 'Message': code},
+            'ResponseMetadata': {'HTTPStatusCode': status, 'HTTPHeaders': headers or {}}
+        },
+        operation
+    )
+
+
+class FakeS3Client:
+    # In-process stand-in for the subset of the boto3 S3 client used by the app. With
+    # discard_bodies only object sizes are kept, for benchmarks that upload very large files.
+    def __init__(self, discard_bodies=False):
+        self.discard_bodies = discard_bodies
+        self.objects = {}
+        self.multipart_uploads = {}
+        self.calls = []
+        self.fail_delete_keys = set()
+        self._lock = threading.Lock()
+
+    def _record(self, operation, **kwargs):
+        with self._lock:
+            self.calls.append((operation, kwargs))
+
+    def call_count(self, operation):
+        return sum(1 for name, _ in self.calls if name == operation)
+
+    def _etag(self, body):
+        if self.discard_bodies:
+            return f'"{len(body):032x}"'
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def _store(self, bucket, key, body, size=None, **kwargs):
+        size = len(body) if size is None else size
+        with self._lock:
+            self.objects[(bucket, key)] = {
+                'Body': b'' if self.discard_bodies else bytes(body),
+                'Size': size,
+                'ETag': f'"{size:032x}"' if self.discard_bodies else self._etag(body),
+                'ContentType': kwargs.get('ContentType', 'binary/octet-stream'),
+                'ContentEncoding': kwargs.get('ContentEncoding'),
+            }
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self._record('upload_fileobj', Bucket=bucket, Key=key)
+        if not self.discard_bodies:
+            self._store(bucket, key, fileobj.read(), **(ExtraArgs or {}))
+            return
+        size = 0
+        while True:
+            chunk = fileobj.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        self._store(bucket, key, b'', size=size, **(ExtraArgs or {}))
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self._record('put_object', Bucket=Bucket, Key=Key)
+        self._store(Bucket, Key, Body, **kwargs)
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._record('create_multipart_upload', Bucket=Bucket, Key=Key)
+        upload_id = str(uuid.uuid4())
+        with self._lock:
+            self.multipart_uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'Parts': {}, 'Args': kwargs}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._record('upload_part', Bucket=Bucket, Key=Key, PartNumber=PartNumber, Size=len(Body))
+        etag = self._etag(Body)
+        with self._lock:
+            self.multipart_uploads[UploadId]['Parts'][PartNumber] = (etag, b'' if self.discard_bodies else bytes(Body), len(Body))
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._record('complete_multipart_upload', Bucket=Bucket, Key=Key)
+        with self._lock:
+            upload = self.multipart_uploads.pop(UploadId)
+        parts = [upload['Parts'][part['PartNumber']] for part in MultipartUpload['Parts']]
+        body = b''.join(part[1] for part in parts)
+        self._store(Bucket, Key, body, size=sum(part[2] for part in parts), **upload['Args'])
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._record('abort_multipart_upload', Bucket=Bucket, Key=Key)
+        with self._lock:
+            self.multipart_uploads.pop(UploadId, None)
+
+    def delete_object(self, Bucket, Key):
+        self._record('delete_object', Bucket=Bucket, Key=Key)
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def head_object(self, Bucket, Key):
+        self._record('head_object', Bucket=Bucket, Key=Key)
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise client_error('404', 404, 'HeadObject')
+        return {
+            'ContentLength': obj['Size'],
+            'ETag': obj['ETag'],
+            'ContentType': obj['ContentType'],
+        }
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None):
+        self._record('get_object', Bucket=Bucket, Key=Key, Range=Range)
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise client_error('NoSuchKey', 404, 'GetObject')
+        if IfMatch is not None and IfMatch != obj['ETag']:
+            raise client_error('PreconditionFailed', 412, 'GetObject')
+        if IfNoneMatch is not None and obj['ETag'] in [tag.strip() for tag in IfNoneMatch.split(',')]:
+            raise client_error('304', 304, 'GetObject', {'etag': obj['ETag']})
+
+        body = obj['Body']
+        size = len(body)
+        response = {'ETag': obj['ETag'], 'ContentType': obj['ContentType']}
+        if obj['ContentEncoding']:
+            response['ContentEncoding'] = obj['ContentEncoding']
+        if Range is not None:
+            start, end = re.fullmatch(r'bytes=(\d*)-(\d*)', Range).groups()
+            if start == '':
+                start, end = max(size - int(end), 0), size - 1
+            else:
+                start, end = int(start), min(int(end), size - 1) if end else size - 1
+            if start >= size:
+                raise client_error('InvalidRange', 416, 'GetObject')
+            body = body[start:end + 1]
+            response['ContentRange'] = f'bytes {start}-{end}/{size}'
+        response['ContentLength'] = len(body)
+        response['Body'] = StreamingBody(io.BytesIO(body), len(body))
+        return response
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        self._record('generate_presigned_url', ClientMethod=ClientMethod, Params=Params)
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        self._record('generate_presigned_post', Bucket=Bucket, Key=Key, Conditions=Conditions)
+        fields = dict(Fields or {})
+        fields['key'] = Key
+        fields['policy'] = 'fake-policy'
+        return {'url': f"https://{Bucket}.s3.local/", 'fields': fields}
+
+    def delete_objects(self, Bucket, Delete):
+        keys = [obj['Key'] for obj in Delete['Objects']]
+        self._record('delete_objects', Bucket=Bucket, Keys=keys)
+        errors = []
+        with self._lock:
+            for key in keys:
+                if key in self.fail_delete_keys:
+                    errors.append({'Key': key, 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+                else:
+                    self.objects.pop((Bucket, key), None)
+        return {'Errors': errors} if errors else {}
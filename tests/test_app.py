@@ -1,6 +1,35 @@
+import gzip
+import io
+import json
+import logging
 import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from logging.handlers import QueueListener, BufferingHandler
+from statsd import StatsClient
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.exc import OperationalError
 import pytest
-from app import app, db, HealthCheck
+from app import (
+    app, db, HealthCheck, File, Blob, SingleFlightCache, health_check_cache, health_check_buffer,
+    health_check_ping_cache,
+    purge_health_checks, get_s3_client, reset_s3_client, s3_client_stats,
+    file_metadata_cache, BoundedQueueHandler, JsonFormatter,
+    FastJsonFormatter, LogSampler, BatchingStatsClient,
+    slow_requests, init_worker, database_engine_options, InstrumentedQueuePool,
+    ReplicaRouter, DeferredHandler, warm_up, warm_up_state, warm_up_database, bootstrap_db, upgrade_schema,
+    ConcurrencyLimiter, get_admission_limiter, reap_deleted_files, FileReaper, file_cache_control,
+    UploadReservation, purge_upload_reservations, claim_tombstoned_files, JobLease, claim_job_lease,
+    run_with_lease
+)
+import app as app_module
+from tests.fake_s3 import FakeS3Client
 
 # Set up test environment
 os.environ['TESTING']='True'
@@ -38,4 +67,1240 @@ def test_service_unavailable(client, monkeypatch):
     
     monkeypatch.setattr(db.session, 'commit', mock_commit)
     response = client.get('/healthz')
-    assert response.status_code == 503
\ No newline at end of file
+    assert response.status_code == 503
+
+def test_health_check_cache_reuses_result(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_CACHE_TTL', 60)
+    health_check_cache.clear()
+
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/cicd').status_code == 200
+
+    with app.app_context():
+        assert HealthCheck.query.count() == 1
+    health_check_cache.clear()
+
+def test_health_check_cache_keeps_failures(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_CACHE_TTL', 60)
+    health_check_cache.clear()
+
+    def mock_commit():
+        raise Exception("Database error")
+
+    monkeypatch.setattr(db.session, 'commit', mock_commit)
+    assert client.get('/healthz').status_code == 503
+    assert client.get('/healthz', data={'random': '12345'}).status_code == 400
+    assert client.get('/healthz').status_code == 503
+    health_check_cache.clear()
+
+def test_single_flight_cache_coalesces_concurrent_calls():
+    cache = SingleFlightCache('test')
+    calls = []
+    release = threading.Event()
+
+    def slow_check():
+        calls.append(1)
+        release.wait(5)
+
+    threads = [threading.Thread(target=cache.get, args=(60, slow_check)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+
+def test_health_check_write_behind_flushes_batches(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_WRITE_BEHIND', True)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_INTERVAL', 3600)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_ROWS', 3)
+
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/healthz').status_code == 200
+    with app.app_context():
+        assert HealthCheck.query.count() == 0
+
+    assert client.get('/healthz').status_code == 200
+    with app.app_context():
+        assert HealthCheck.query.count() == 3
+    assert len(health_check_buffer) == 0
+
+def test_health_check_write_behind_reports_flush_failure(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_WRITE_BEHIND', True)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_INTERVAL', 3600)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_ROWS', 1)
+
+    def mock_commit():
+        raise Exception("Database error")
+
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'commit', mock_commit)
+        assert client.get('/healthz').status_code == 503
+    assert len(health_check_buffer) == 1
+
+    assert client.get('/healthz').status_code == 200
+    with app.app_context():
+        assert HealthCheck.query.count() == 2
+
+def test_health_check_write_behind_pings_database(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_WRITE_BEHIND', True)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_INTERVAL', 3600)
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_FLUSH_ROWS', 100)
+    health_check_ping_cache.clear()
+
+    def mock_execute(*args, **kwargs):
+        raise Exception("Database error")
+
+    # Nothing is flushed yet, but the database is down
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'execute', mock_execute)
+        assert client.get('/healthz').status_code == 503
+        assert client.get('/cicd').status_code == 503
+
+    health_check_ping_cache.clear()
+    assert client.get('/healthz').status_code == 200
+    health_check_ping_cache.clear()
+    with app.app_context():
+        health_check_buffer.flush()
+        assert HealthCheck.query.count() == 3
+
+def test_purge_health_checks_deletes_old_rows_in_batches(client):
+    with app.app_context():
+        old = datetime.now() - timedelta(days=10)
+        db.session.add_all([HealthCheck(created_at=old) for _ in range(5)])
+        db.session.add(HealthCheck())
+        db.session.commit()
+
+        assert purge_health_checks(retention_days=7, batch_size=2) == 5
+        assert HealthCheck.query.count() == 1
+
+def test_job_lease_lets_one_worker_run_a_job_per_interval(client):
+    runs = []
+    with app.app_context():
+        # Several workers wake up for the same round; only the first one runs the job
+        for _ in range(3):
+            run_with_lease('health_check_retention', 60, lambda: runs.append(1))
+        assert runs == [1]
+
+        lease = db.session.get(JobLease, 'health_check_retention')
+        lease.leased_until = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        run_with_lease('health_check_retention', 60, lambda: runs.append(1))
+        run_with_lease('health_check_retention', 60, lambda: runs.append(1))
+        assert runs == [1, 1]
+
+def test_job_lease_first_claim_race_is_lost_not_raised(client, monkeypatch):
+    original = app_module.time_db_operation
+
+    def time_db_operation(name, func, *args):
+        if name == 'get_job_lease':
+            # Another worker inserts the lease between our read and our commit
+            db.session.execute(JobLease.__table__.insert().values(
+                name='health_check_retention', leased_until=datetime.now() + timedelta(seconds=60)
+            ))
+            return None
+        return original(name, func, *args)
+
+    monkeypatch.setattr('app.time_db_operation', time_db_operation)
+    with app.app_context():
+        assert claim_job_lease('health_check_retention', 60) is False
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3Client()
+    monkeypatch.setattr('app.get_s3_client', lambda: fake)
+    monkeypatch.setenv('S3_BUCKET_NAME', 'test-bucket')
+    return fake
+
+def test_streaming_upload_small_file_uses_single_put(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', True)
+
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'hello world'), 'hello.txt')})
+    assert response.status_code == 201
+
+    body = response.get_json()
+    assert body['url'] == f"test-bucket/{body['id']}/hello.txt"
+    assert s3.objects[('test-bucket', f"{body['id']}/hello.txt")]['Body'] == b'hello world'
+    assert s3.call_count('put_object') == 1
+    with app.app_context():
+        assert db.session.get(File, body['id']) is not None
+
+def test_streaming_upload_large_file_uses_multipart(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_PART_SIZE', 1024 * 1024)
+    monkeypatch.setitem(app.config, 'UPLOAD_PART_CONCURRENCY', 2)
+    content = os.urandom(1024 * 1024 * 2 + 512)
+
+    response = client.post('/v2/file', data={'file': (io.BytesIO(content), 'big.bin')})
+    assert response.status_code == 201
+
+    file_id = response.get_json()['id']
+    assert s3.objects[('test-bucket', f"{file_id}/big.bin")]['Body'] == content
+    assert s3.call_count('upload_part') == 3
+    assert s3.call_count('complete_multipart_upload') == 1
+
+def test_streaming_upload_without_file_part(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', True)
+
+    response = client.post('/v2/file', data={'other': 'value'})
+    assert response.status_code == 400
+    assert s3.calls == []
+
+def test_streaming_upload_aborts_on_part_failure(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_PART_SIZE', 1024 * 1024)
+
+    def failing_upload_part(**kwargs):
+        raise Exception("S3 error")
+
+    monkeypatch.setattr(s3, 'upload_part', failing_upload_part)
+    response = client.post('/v2/file', data={'file': (io.BytesIO(os.urandom(3 * 1024 * 1024)), 'big.bin')})
+    assert response.status_code == 400
+    assert s3.call_count('abort_multipart_upload') == 1
+    with app.app_context():
+        assert File.query.count() == 0
+
+def test_presigned_upload_flow(client, s3):
+    response = client.post('/v2/file/presign', json={'file_name': 'report.pdf'})
+    assert response.status_code == 201
+    reservation = response.get_json()
+    assert reservation['method'] == 'PUT'
+    assert f"{reservation['id']}/report.pdf" in reservation['upload_url']
+
+    # Nothing to confirm until the client has uploaded the object
+    response = client.post(f"/v2/file/{reservation['id']}/complete", json={'file_name': 'report.pdf'})
+    assert response.status_code == 400
+
+    s3.put_object(Bucket='test-bucket', Key=f"{reservation['id']}/report.pdf", Body=b'%PDF')
+    response = client.post(f"/v2/file/{reservation['id']}/complete", json={'file_name': 'report.pdf'})
+    assert response.status_code == 201
+    assert response.get_json()['url'] == f"test-bucket/{reservation['id']}/report.pdf"
+
+    response = client.get(f"/v1/file/{reservation['id']}")
+    assert response.status_code == 200
+
+    # Confirming twice does not create a second row
+    response = client.post(f"/v2/file/{reservation['id']}/complete", json={'file_name': 'report.pdf'})
+    assert response.status_code == 400
+
+def test_complete_upload_requires_a_pending_reservation(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    first = upload_content(client, b'same content', 'a.txt')
+    second = upload_content(client, b'same content', 'b.txt')
+    assert client.delete(f'/v1/file/{first}').status_code == 204
+
+    # Completing an id that was never presigned must not recreate the deleted file
+    s3.put_object(Bucket='test-bucket', Key=f"{first}/a.txt", Body=b'same content')
+    response = client.post(f"/v2/file/{first}/complete", json={'file_name': 'a.txt'})
+    assert response.status_code == 400
+    assert client.delete(f'/v1/file/{first}').status_code == 404
+    assert client.get(f'/v1/file/{second}/content').get_data() == b'same content'
+
+    # A reservation is bound to its file name and expires
+    reservation = client.post('/v2/file/presign', json={'file_name': 'report.pdf'}).get_json()
+    s3.put_object(Bucket='test-bucket', Key=f"{reservation['id']}/other.pdf", Body=b'%PDF')
+    assert client.post(f"/v2/file/{reservation['id']}/complete", json={'file_name': 'other.pdf'}).status_code == 400
+    s3.put_object(Bucket='test-bucket', Key=f"{reservation['id']}/report.pdf", Body=b'%PDF')
+    with app.app_context():
+        db.session.get(UploadReservation, reservation['id']).expires_at = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+    assert client.post(f"/v2/file/{reservation['id']}/complete", json={'file_name': 'report.pdf'}).status_code == 400
+    with app.app_context():
+        assert purge_upload_reservations() == 1
+        assert UploadReservation.query.count() == 0
+        assert db.session.get(File, reservation['id']) is None
+
+def test_maintenance_jobs_run_in_one_worker(client, monkeypatch):
+    scheduled = []
+    purged = []
+    monkeypatch.setattr('app.run_periodically', lambda name, interval, func: scheduled.append((name, func)))
+    monkeypatch.setattr('app.purge_upload_reservations', lambda: purged.append('reservations'))
+    monkeypatch.setattr('app.purge_health_checks', lambda days, batch: purged.append('health_checks'))
+    monkeypatch.setitem(app.config, 'HEALTH_CHECK_RETENTION_DAYS', 7)
+    monkeypatch.setitem(app.config, 'UPLOAD_RESERVATION_PURGE_INTERVAL', 60)
+
+    # Three workers each schedule the jobs, then all wake up for the same round
+    for _ in range(3):
+        app_module.start_background_jobs()
+    with app.app_context():
+        for name, func in scheduled:
+            if name in ('health_check_retention', 'upload_reservation_purge'):
+                func()
+
+    assert sorted(purged) == ['health_checks', 'reservations']
+
+def test_presigned_post_upload(client, s3):
+    response = client.post('/v2/file/presign', json={'file_name': 'data.csv', 'method': 'post'})
+    assert response.status_code == 201
+    reservation = response.get_json()
+    assert reservation['fields']['key'] == f"{reservation['id']}/data.csv"
+
+def test_presigned_upload_rejects_bad_requests(client, s3):
+    assert client.post('/v2/file/presign', json={}).status_code == 400
+    assert client.post('/v2/file/presign', json={'file_name': 'a.txt', 'method': 'GET'}).status_code == 400
+    assert client.post('/v2/file/not-a-uuid/complete', json={'file_name': 'a.txt'}).status_code == 400
+
+def test_s3_client_is_shared_and_rebuilt_after_fork(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setitem(app.config, 'S3_MAX_POOL_CONNECTIONS', 25)
+    reset_s3_client()
+
+    first = get_s3_client()
+    assert get_s3_client() is first
+    assert first.meta.config.max_pool_connections == 25
+
+    # A different pid means we are running in a forked child
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert get_s3_client() is not first
+    assert s3_client_stats()['pid'] == -1
+    reset_s3_client()
+
+def create_file_row(file_id, file_name='report.pdf'):
+    with app.app_context():
+        db.session.add(File(id=file_id, file_name=file_name, url=f"test-bucket/{file_id}/{file_name}"))
+        db.session.commit()
+
+def test_file_metadata_cache_serves_repeated_reads(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_CACHE_SIZE', 10)
+    file_metadata_cache.clear()
+    create_file_row('cached-id')
+
+    assert client.get('/v1/file/cached-id').status_code == 200
+    with app.app_context():
+        File.query.filter_by(id='cached-id').delete()
+        db.session.commit()
+    assert client.get('/v1/file/cached-id').get_json()['id'] == 'cached-id'
+    file_metadata_cache.clear()
+
+def test_file_metadata_cache_invalidated_by_delete(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_CACHE_SIZE', 10)
+    file_metadata_cache.clear()
+
+    file_id = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')}).get_json()['id']
+    assert client.get(f'/v1/file/{file_id}').status_code == 200
+    assert client.delete(f'/v1/file/{file_id}').status_code == 204
+    assert client.get(f'/v1/file/{file_id}').status_code == 400
+    file_metadata_cache.clear()
+
+def test_file_metadata_cache_negative_lookups_and_eviction(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_CACHE_SIZE', 2)
+    monkeypatch.setitem(app.config, 'FILE_CACHE_NEGATIVE_TTL', 60)
+    file_metadata_cache.clear()
+
+    assert client.get('/v1/file/missing-id').status_code == 400
+    create_file_row('missing-id')
+    assert client.get('/v1/file/missing-id').status_code == 400
+
+    file_metadata_cache.put('a', {'id': 'a'})
+    file_metadata_cache.put('b', {'id': 'b'})
+    assert len(file_metadata_cache) == 2
+    assert file_metadata_cache.get('missing-id') == (False, None)
+    file_metadata_cache.clear()
+
+def test_lookup_files_returns_found_and_missing(client):
+    create_file_row('id-1', 'a.txt')
+    create_file_row('id-2', 'b.txt')
+
+    response = client.post('/v1/files/lookup', json={'ids': ['id-2', 'nope', 'id-1', 'id-2']})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [f['id'] for f in body['files']] == ['id-2', 'id-1']
+    assert body['files'][1] == client.get('/v1/file/id-1').get_json()
+    assert body['missing'] == ['nope']
+
+def test_lookup_files_rejects_invalid_requests(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_BATCH_MAX_IDS', 2)
+    assert client.post('/v1/files/lookup', json={'ids': []}).status_code == 400
+    assert client.post('/v1/files/lookup', json={'ids': ['a', 'b', 'c']}).status_code == 400
+    assert client.post('/v1/files/lookup', json={'ids': [1]}).status_code == 400
+    assert client.post('/v1/files/lookup', data='not json').status_code == 400
+
+def test_bulk_delete_files_reports_per_id_results(client, s3, monkeypatch):
+    monkeypatch.setattr('app.S3_DELETE_OBJECTS_MAX_KEYS', 2)
+    for file_id in ['id-1', 'id-2', 'id-3']:
+        create_file_row(file_id)
+        s3.put_object(Bucket='test-bucket', Key=f"{file_id}/report.pdf", Body=b'data')
+    s3.fail_delete_keys.add('id-2/report.pdf')
+
+    response = client.post('/v1/files/delete', json={'ids': ['id-1', 'id-2', 'id-3', 'missing']})
+    assert response.status_code == 200
+    statuses = {result['id']: result['status'] for result in response.get_json()['results']}
+    assert statuses == {'id-1': 'deleted', 'id-2': 'error', 'id-3': 'deleted', 'missing': 'not_found'}
+    assert s3.call_count('delete_objects') == 2
+
+    with app.app_context():
+        assert [file.id for file in File.query.all()] == ['id-2']
+    assert ('test-bucket', 'id-2/report.pdf') in s3.objects
+    assert ('test-bucket', 'id-1/report.pdf') not in s3.objects
+
+def test_bulk_delete_files_rejects_invalid_requests(client, s3):
+    assert client.post('/v1/files/delete', json={'ids': 'id-1'}).status_code == 400
+
+def test_list_files_pages_with_cursor(client):
+    with app.app_context():
+        for day, file_id in [(3, 'c'), (1, 'b'), (1, 'a'), (2, 'd'), (5, 'e')]:
+            db.session.add(File(id=file_id, file_name=f"{file_id}.txt", url=f"bucket/{file_id}", upload_date=date(2025, 1, day)))
+        db.session.commit()
+
+    seen = []
+    response = client.get('/v1/files?limit=2')
+    while True:
+        assert response.status_code == 200
+        body = response.get_json()
+        seen.extend(f['id'] for f in body['files'])
+        if not body['next_cursor']:
+            break
+        response = client.get(f"/v1/files?limit=2&cursor={body['next_cursor']}")
+    assert seen == ['a', 'b', 'd', 'c', 'e']
+
+    body = client.get('/v1/files?from=2025-01-02&to=2025-01-03').get_json()
+    assert [f['id'] for f in body['files']] == ['d', 'c']
+    assert body['next_cursor'] is None
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=abc', 'from=yesterday', 'cursor=garbage'])
+def test_list_files_rejects_invalid_parameters(client, query):
+    assert client.get(f'/v1/files?{query}').status_code == 400
+
+def make_record(level, message='message'):
+    return logging.LogRecord('webapp', level, __file__, 0, message, None, None)
+
+def test_bounded_queue_handler_drops_when_full():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2), overflow='drop')
+    for _ in range(5):
+        handler.handle(make_record(logging.INFO))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+def test_bounded_queue_handler_block_times_out():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=1), overflow='block', block_timeout=0.01)
+    handler.handle(make_record(logging.INFO))
+    handler.handle(make_record(logging.INFO))
+    assert handler.dropped == 1
+
+def test_bounded_queue_handler_samples_low_severity_records():
+    handler = BoundedQueueHandler(queue.Queue(maxsize=40), overflow='sample', sample_rate=5)
+    for _ in range(50):
+        handler.handle(make_record(logging.INFO))
+    for _ in range(10):
+        handler.handle(make_record(logging.ERROR))
+    records = [handler.queue.get_nowait() for _ in range(handler.queue.qsize())]
+
+    # 20 records fill the queue to half, then only every 5th of the remaining 30 is kept
+    assert len([r for r in records if r.levelno == logging.INFO]) == 26
+    assert len([r for r in records if r.levelno == logging.ERROR]) == 10
+    assert handler.dropped == 24
+
+def test_queue_listener_ships_records_off_thread():
+    shipped = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            shipped.append((threading.current_thread().name, self.format(record)))
+
+    list_handler = ListHandler()
+    list_handler.setFormatter(JsonFormatter())
+    handler = BoundedQueueHandler(queue.Queue(maxsize=10))
+    listener = QueueListener(handler.queue, list_handler)
+    listener.start()
+    handler.handle(make_record(logging.INFO, 'shipped later'))
+    listener.stop()
+
+    assert len(shipped) == 1
+    assert shipped[0][0] != threading.current_thread().name
+    assert json.loads(shipped[0][1])['message'] == 'shipped later'
+
+def test_fast_json_formatter_matches_json_formatter():
+    record = make_record(logging.INFO, 'Response sent')
+    record.path = '/v1/file/abc'
+    record.method = 'GET'
+    record.status_code = 200
+    record.remote_addr = ''
+
+    fast = json.loads(FastJsonFormatter().format(record))
+    slow = json.loads(JsonFormatter().format(record))
+    assert fast.pop('timestamp')[:19] == slow.pop('timestamp')[:19]
+    assert fast == {key: value for key, value in slow.items() if value != ''}
+
+def test_fast_json_formatter_includes_exceptions():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord('webapp', logging.ERROR, __file__, 0, 'failed "quoted"', None, sys.exc_info())
+    output = json.loads(FastJsonFormatter().format(record))
+    assert output['message'] == 'failed "quoted"'
+    assert 'ValueError: boom' in output['exception']
+
+def test_log_sampler_thins_info_by_message_and_operation():
+    sampler = LogSampler({'Database operation * completed': 0.25, 's3.upload_file': 0})
+
+    kept = [sampler.filter(make_record(logging.INFO, 'Database operation get_file completed')) for _ in range(8)]
+    assert kept.count(True) == 2
+
+    s3_record = make_record(logging.INFO, 'S3 upload finished')
+    s3_record.operation = 's3.upload_file'
+    assert not sampler.filter(s3_record)
+    assert sampler.filter(make_record(logging.INFO, 'Request received'))
+    assert all(sampler.filter(make_record(logging.ERROR, 'Database operation get_file completed')) for _ in range(4))
+
+def test_log_sampler_cache_stays_bounded_for_interpolated_messages(monkeypatch):
+    monkeypatch.setattr(LogSampler, 'RESOLVED_CACHE_SIZE', 16)
+    sampler = LogSampler({'Uploaded file *': 0.5})
+
+    kept = [sampler.filter(make_record(logging.INFO, f'Uploaded file {n}')) for n in range(100)]
+    assert kept.count(True) == 50
+    assert len(sampler._resolved) == 16
+    assert list(sampler._credit) == ['Uploaded file *']
+
+@pytest.fixture
+def statsd_sink():
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.settimeout(1)
+    yield sink
+    sink.close()
+
+def read_datagrams(sink):
+    datagrams = []
+    try:
+        while True:
+            sink.settimeout(0.2)
+            datagrams.append(sink.recv(65535).decode())
+    except socket.timeout:
+        return datagrams
+
+def test_statsd_batching_sends_one_datagram_per_request(client, statsd_sink, monkeypatch):
+    port = statsd_sink.getsockname()[1]
+    batching = BatchingStatsClient(StatsClient('127.0.0.1', port, prefix='webapp', maxudpsize=1432), batching=True)
+    monkeypatch.setattr('app.statsd_client', batching)
+
+    assert client.get('/healthz').status_code == 200
+    datagrams = read_datagrams(statsd_sink)
+    assert len(datagrams) == 1
+    lines = datagrams[0].split('\n')
+    assert 'webapp.api.health_check:1|c' in lines
+    assert any(line.startswith('webapp.db.health_check_commit:') for line in lines)
+    assert any(line.startswith('webapp.api.health_check.time:') for line in lines)
+
+def test_statsd_aggregator_pre_sums_counters(statsd_sink):
+    port = statsd_sink.getsockname()[1]
+    batching = BatchingStatsClient(StatsClient('127.0.0.1', port, prefix='webapp'), aggregate_interval=3600)
+    for _ in range(5):
+        batching.incr('api.get_file')
+    batching.incr('api.delete_file', 2)
+    batching.flush()
+
+    assert sorted(read_datagrams(statsd_sink)[0].split('\n')) == [
+        'webapp.api.delete_file:2|c', 'webapp.api.get_file:5|c'
+    ]
+
+def test_request_tracing_adds_server_timing_and_slow_log(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'REQUEST_TRACING', True)
+    monkeypatch.setitem(app.config, 'TRACE_SLOW_REQUESTS', 1)
+    monkeypatch.setitem(app.config, 'TRACE_DEBUG_ENDPOINT', True)
+    slow_requests.clear()
+
+    response = client.get('/healthz')
+    server_timing = response.headers['Server-Timing']
+    assert 'handler;dur=' in server_timing
+    assert 'db.health_check_commit;dur=' in server_timing
+    assert 'log;dur=' in server_timing
+    assert 'total;dur=' in server_timing
+
+    client.get('/v1/file/missing')
+    traces = client.get('/debug/slow-requests').get_json()['requests']
+    assert len(traces) == 1
+    spans = traces[0]['spans']
+    assert [span['depth'] for span in spans if span['name'] == 'handler'] == [0]
+    assert any(span['name'].startswith('db.') and span['depth'] == 1 for span in spans)
+    slow_requests.clear()
+
+def test_debug_endpoint_disabled_by_default(client):
+    assert client.get('/debug/slow-requests').status_code == 404
+    assert 'Server-Timing' not in client.get('/healthz').headers
+
+def test_init_worker_resets_process_resources(monkeypatch):
+    started = []
+    monkeypatch.setattr('app.start_background_jobs', lambda: started.append('jobs'))
+    monkeypatch.setattr('app.start_warm_up', lambda: started.append('warm_up'))
+    monkeypatch.setattr('app._s3_client', object())
+
+    init_worker()
+    assert started == ['jobs', 'warm_up']
+    assert app_module._s3_client is None
+
+def test_overlapped_upload_inserts_while_s3_transfers(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_OVERLAP_DB_WRITE', True)
+    flushed = threading.Event()
+    original_flush = db.session.flush
+    original_upload = s3.upload_fileobj
+
+    def recording_flush(*args, **kwargs):
+        original_flush(*args, **kwargs)
+        flushed.set()
+
+    def slow_upload(*args, **kwargs):
+        # The pending row is written while the transfer is still running
+        assert flushed.wait(2)
+        original_upload(*args, **kwargs)
+
+    monkeypatch.setattr(db.session, 'flush', recording_flush)
+    monkeypatch.setattr(s3, 'upload_fileobj', slow_upload)
+
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 201
+    file_id = response.get_json()['id']
+    assert ('test-bucket', f"{file_id}/a.txt") in s3.objects
+    with app.app_context():
+        assert db.session.get(File, file_id) is not None
+
+def test_overlapped_upload_rolls_back_row_when_s3_fails(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_OVERLAP_DB_WRITE', True)
+
+    def failing_upload(*args, **kwargs):
+        raise Exception("S3 error")
+
+    monkeypatch.setattr(s3, 'upload_fileobj', failing_upload)
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 400
+    with app.app_context():
+        assert File.query.count() == 0
+
+def test_overlapped_upload_deletes_object_when_commit_fails(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_OVERLAP_DB_WRITE', True)
+
+    def mock_commit():
+        raise Exception("Database error")
+
+    monkeypatch.setattr(db.session, 'commit', mock_commit)
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 400
+    assert s3.objects == {}
+    assert s3.call_count('delete_object') == 1
+
+def test_overlapped_upload_keeps_object_when_commit_outcome_is_unclear(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_OVERLAP_DB_WRITE', True)
+    original_commit = db.session.commit
+
+    def commit_then_fail():
+        # The row is committed but the reply is lost
+        original_commit()
+        raise Exception("Lost connection during commit")
+
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'commit', commit_then_fail)
+        response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 201
+    file_id = response.get_json()['id']
+    assert ('test-bucket', f"{file_id}/a.txt") in s3.objects
+    assert s3.call_count('delete_object') == 0
+
+    def mock_commit():
+        raise Exception("Database error")
+
+    def mock_get(*args, **kwargs):
+        raise Exception("Database unreachable")
+
+    # Neither outcome can be confirmed, so the object stays
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'commit', mock_commit)
+        m.setattr(db.session, 'get', mock_get)
+        response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'b.txt')})
+    assert response.status_code == 400
+    assert len(s3.objects) == 2
+    assert s3.call_count('delete_object') == 0
+
+class RecordingStats:
+    def __init__(self):
+        self.metrics = []
+
+    def incr(self, stat, count=1, rate=1):
+        self.metrics.append(('incr', stat, count))
+
+    def timing(self, stat, delta, rate=1):
+        self.metrics.append(('timing', stat, delta))
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        self.metrics.append(('gauge', stat, value))
+
+    def names(self):
+        return [name for _, name, _ in self.metrics]
+
+    def start_request(self):
+        pass
+
+    def finish_request(self):
+        pass
+
+def test_database_engine_options_from_environment(monkeypatch):
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'False')
+    options = database_engine_options('mysql://user:pass@db/webapp')
+    assert options['poolclass'] is InstrumentedQueuePool
+    assert options['pool_size'] == 4
+    assert options['pool_pre_ping'] is False
+    assert database_engine_options('sqlite:///:memory:') == {}
+
+def test_instrumented_pool_reports_checkouts_and_timeouts(tmp_path, monkeypatch):
+    stats = RecordingStats()
+    monkeypatch.setattr('app.statsd_client', stats)
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+
+    with engine.connect():
+        with pytest.raises(Exception):
+            engine.connect()
+    engine.dispose()
+
+    names = stats.names()
+    assert names.count('db.pool.checkout') == 1
+    assert names.count('db.pool.checkout_timeout') == 1
+    assert names.count('db.pool.checkout_wait') == 2
+    assert 'db.pool.connect' in names
+
+def test_instrumented_pool_counts_connect_errors_separately(monkeypatch):
+    stats = RecordingStats()
+    monkeypatch.setattr('app.statsd_client', stats)
+
+    def refuse():
+        raise ConnectionRefusedError('database unreachable')
+
+    engine = create_engine('sqlite://', creator=refuse, poolclass=InstrumentedQueuePool, pool_size=1)
+    with pytest.raises(Exception):
+        engine.connect()
+
+    names = stats.names()
+    assert 'db.pool.checkout_error' in names
+    assert 'db.pool.checkout_timeout' not in names
+
+@pytest.fixture
+def replica(client, monkeypatch):
+    # Installs an in-memory SQLite "replica" holding its own copy of the schema
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    db.metadata.create_all(engine)
+    monkeypatch.setattr('app.replica_router', ReplicaRouter())
+    with app.app_context():
+        monkeypatch.setitem(db.engines, 'replica', engine)
+    yield engine
+    engine.dispose()
+
+def insert_replica_row(engine, file_id, upload_date=None):
+    with engine.begin() as connection:
+        connection.execute(File.__table__.insert().values(
+            id=file_id, file_name='replica.txt', url=f'test-bucket/{file_id}/replica.txt',
+            upload_date=upload_date or date.today()
+        ))
+
+def test_reads_use_replica_and_retry_misses_on_primary(client, replica):
+    insert_replica_row(replica, 'replicated')
+    create_file_row('replicated', file_name='primary.txt')
+    create_file_row('not-replicated')
+
+    assert client.get('/v1/file/replicated').get_json()['file_name'] == 'replica.txt'
+    # Not replicated yet: the miss is retried on the primary
+    assert client.get('/v1/file/not-replicated').status_code == 200
+    lookup = client.post('/v1/files/lookup', json={'ids': ['replicated', 'not-replicated']}).get_json()
+    assert lookup['missing'] == []
+
+def test_reads_stay_on_primary_after_a_write(client, replica, s3):
+    insert_replica_row(replica, 'replica-only')
+    assert [f['id'] for f in client.get('/v1/files').get_json()['files']] == ['replica-only']
+
+    upload = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'new.txt')},
+                         content_type='multipart/form-data')
+    assert upload.status_code == 201
+    assert [f['id'] for f in client.get('/v1/files').get_json()['files']] == [upload.get_json()['id']]
+
+def test_a_write_only_pins_the_writing_client_to_the_primary(client, replica, s3):
+    insert_replica_row(replica, 'replica-only')
+    upload = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'new.txt')})
+    assert upload.status_code == 201
+    assert ReplicaRouter.COOKIE in upload.headers['Set-Cookie']
+
+    with app.test_client() as other:
+        assert [f['id'] for f in other.get('/v1/files').get_json()['files']] == ['replica-only']
+        # The miss retry still finds the new row for a client that has not written
+        assert other.get(f"/v1/file/{upload.get_json()['id']}").status_code == 200
+    assert [f['id'] for f in client.get('/v1/files').get_json()['files']] == [upload.get_json()['id']]
+
+def test_replica_failure_falls_back_to_primary(client, replica, monkeypatch, tmp_path):
+    broken = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    with app.app_context():
+        monkeypatch.setitem(db.engines, 'replica', broken)
+    create_file_row('primary-row')
+
+    assert client.get('/v1/file/primary-row').status_code == 200
+    assert not app_module.replica_router.use_replica(0)
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_dedup_upload_reuses_stored_object(client, s3, monkeypatch, streaming):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', streaming)
+
+    first = client.post('/v2/file', data={'file': (io.BytesIO(b'same report'), 'a.pdf')}).get_json()
+    second = client.post('/v2/file', data={'file': (io.BytesIO(b'same report'), 'b.pdf')}).get_json()
+    other = client.post('/v2/file', data={'file': (io.BytesIO(b'other report'), 'c.pdf')}).get_json()
+
+    assert second['url'] == first['url']
+    assert second['file_name'] == 'b.pdf'
+    assert other['url'] != first['url']
+    assert len(s3.objects) == 2
+    with app.app_context():
+        digest = db.session.get(File, first['id']).content_sha256
+        assert db.session.get(Blob, digest).ref_count == 2
+
+def test_dedup_streaming_duplicate_aborts_multipart_upload(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_PART_SIZE', 1024 * 1024)
+    content = os.urandom(1024 * 1024 + 512)
+
+    assert client.post('/v2/file', data={'file': (io.BytesIO(content), 'a.bin')}).status_code == 201
+    assert client.post('/v2/file', data={'file': (io.BytesIO(content), 'b.bin')}).status_code == 201
+
+    assert s3.call_count('complete_multipart_upload') == 1
+    assert s3.call_count('abort_multipart_upload') == 1
+    assert len(s3.objects) == 1
+
+def test_dedup_objects_are_stored_outside_per_file_keys(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    first = upload_content(client, b'shared', 'a.txt')
+    second = upload_content(client, b'shared', 'b.txt')
+
+    assert list(s3.objects) == [('test-bucket', f"blobs/{first}")]
+    # A plain file under the first uploader's id never shares the blob's key
+    create_file_row(first + '-plain')
+    s3.objects[('test-bucket', f"{first}/a.txt")] = dict(s3.objects[('test-bucket', f"blobs/{first}")])
+    with app.app_context():
+        db.session.get(File, first + '-plain').url = f"test-bucket/{first}/a.txt"
+        db.session.commit()
+    assert client.delete(f'/v1/file/{first}-plain').status_code == 204
+    assert client.delete(f'/v1/file/{first}').status_code == 204
+    assert client.get(f'/v1/file/{second}/content').get_data() == b'shared'
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_dedup_deletes_stored_object_when_metadata_write_fails(client, s3, monkeypatch, streaming):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', streaming)
+
+    def mock_commit():
+        raise Exception("Database error")
+
+    with monkeypatch.context() as m:
+        m.setattr(db.session, 'commit', mock_commit)
+        response = client.post('/v2/file', data={'file': (io.BytesIO(b'report'), 'a.pdf')})
+    assert response.status_code == 400
+    assert s3.objects == {}
+    assert s3.call_count('delete_object') == 1
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+def test_dedup_delete_removes_object_with_last_reference(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    ids = [
+        client.post('/v2/file', data={'file': (io.BytesIO(b'shared'), f'{name}.txt')}).get_json()['id']
+        for name in ('a', 'b', 'c')
+    ]
+
+    assert client.delete(f'/v1/file/{ids[0]}').status_code == 204
+    assert len(s3.objects) == 1
+    response = client.post('/v1/files/delete', json={'ids': ids[1:]})
+    assert [result['status'] for result in response.get_json()['results']] == ['deleted', 'deleted']
+    assert s3.objects == {}
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_concurrent_deletes_release_a_blob_reference_once(client, s3, monkeypatch, bulk):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    first = client.post('/v2/file', data={'file': (io.BytesIO(b'shared'), 'a.txt')}).get_json()['id']
+    second = client.post('/v2/file', data={'file': (io.BytesIO(b'shared'), 'b.txt')}).get_json()['id']
+    original = app_module.time_db_operation
+
+    def racing_time_db_operation(operation_name, func, *args, **kwargs):
+        result = original(operation_name, func, *args, **kwargs)
+        if operation_name in ('get_file_for_delete', 'get_files_for_bulk_delete'):
+            # Another request deletes the same file between this read and the row lock
+            db.session.execute(File.__table__.delete().where(File.id == first))
+            db.session.execute(Blob.__table__.update().values(ref_count=Blob.ref_count - 1))
+            # Committed elsewhere, so the rows this request loaded stay as they were
+            session = db.session()
+            session.expire_on_commit = False
+            session.commit()
+            session.expire_on_commit = True
+        return result
+
+    monkeypatch.setattr('app.time_db_operation', racing_time_db_operation)
+    if bulk:
+        response = client.post('/v1/files/delete', json={'ids': [first]})
+        assert response.get_json()['results'] == [{'id': first, 'status': 'not_found'}]
+    else:
+        assert client.delete(f'/v1/file/{first}').status_code == 404
+    monkeypatch.setattr('app.time_db_operation', original)
+
+    with app.app_context():
+        assert Blob.query.one().ref_count == 1
+    assert client.get(f'/v1/file/{second}/content').get_data() == b'shared'
+
+def upload_content(client, content, name='data.bin'):
+    response = client.post('/v2/file', data={'file': (io.BytesIO(content), name)})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def test_download_streams_object_in_chunks(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'DOWNLOAD_CHUNK_SIZE', 1000)
+    content = os.urandom(10_500)
+    file_id = upload_content(client, content)
+
+    response = client.get(f'/v1/file/{file_id}/content', buffered=False)
+    chunks = list(response.response)
+    response.close()
+
+    assert response.status_code == 200
+    assert b''.join(chunks) == content
+    assert max(len(chunk) for chunk in chunks) == 1000
+    assert response.headers['Content-Length'] == str(len(content))
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'data.bin' in response.headers['Content-Disposition']
+
+def test_download_supports_ranges_and_conditional_requests(client, s3):
+    content = bytes(range(256)) * 4
+    file_id = upload_content(client, content)
+    etag = client.get(f'/v1/file/{file_id}/content').headers['ETag']
+
+    partial = client.get(f'/v1/file/{file_id}/content', headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert partial.data == content[100:200]
+    assert partial.headers['Content-Range'] == f'bytes 100-199/{len(content)}'
+    assert client.get(f'/v1/file/{file_id}/content', headers={'Range': 'bytes=-24'}).data == content[-24:]
+
+    not_modified = client.get(f'/v1/file/{file_id}/content', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == etag
+
+    stale = client.get(f'/v1/file/{file_id}/content', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == content
+    assert client.get(f'/v1/file/{file_id}/content', headers={'Range': 'bytes=5000-'}).status_code == 416
+
+def test_download_unknown_file(client, s3):
+    assert client.get('/v1/file/missing/content').status_code == 404
+
+def test_file_metadata_is_cacheable_and_revalidated(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config['CACHE_POLICIES'], 'get_file', 'public, max-age=60')
+    create_file_row('cacheable-id')
+
+    response = client.get('/v1/file/cacheable-id')
+    assert response.headers['Cache-Control'] == 'public, max-age=60'
+    assert 'Pragma' not in response.headers
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+
+    revalidated = client.get('/v1/file/cacheable-id', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+    assert client.get('/v1/file/cacheable-id', headers={'If-None-Match': '"other"'}).status_code == 200
+
+def test_file_responses_are_not_shared_cacheable_by_default(client, s3):
+    create_file_row('default-policy-id')
+    assert client.get('/v1/file/default-policy-id').headers['Cache-Control'] == 'no-cache'
+    assert file_cache_control(0, True) == 'no-cache'
+    assert file_cache_control(60, False) == 'private, max-age=60'
+    assert file_cache_control(60, True) == 'public, max-age=60'
+
+def test_errors_and_health_checks_are_not_cacheable(client):
+    assert client.get('/v1/file/unknown-id').headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+    response = client.get('/healthz')
+    assert response.headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+    assert 'ETag' not in response.headers
+
+def test_deferred_handler_replays_buffered_records():
+    handler = DeferredHandler(capacity=2)
+    for message in ('one', 'two', 'three'):
+        handler.handle(make_record(logging.INFO, message))
+
+    target = BufferingHandler(capacity=10)
+    handler.set_target(target)
+    handler.handle(make_record(logging.INFO, 'four'))
+    assert [record.getMessage() for record in target.buffer] == ['two', 'three', 'four']
+
+def test_readiness_follows_warm_up(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'WARM_UP_RETRY_INTERVAL', 0)
+    attempts = []
+
+    def flaky_s3():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('S3 endpoint unreachable')
+
+    monkeypatch.setattr('app.WARM_UP_STEPS', [('database', warm_up_database), ('s3', flaky_s3)])
+    warm_up_state.clear()
+    assert client.get('/readyz').status_code == 503
+
+    warm_up()
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['components'] == {'database': True, 's3': False}
+    assert response.headers['Cache-Control'] == 'no-cache, no-store, must-revalidate'
+
+    warm_up()
+    assert client.get('/readyz').get_json() == {'ready': True, 'components': {'database': True, 's3': True}}
+    warm_up_state.clear()
+
+def test_schema_is_bootstrapped_once_and_workers_only_ping(client, monkeypatch):
+    calls = []
+    create_all = db.create_all
+
+    def racing_create_all(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            # Another instance created a table first, so this run stopped before the others
+            db.drop_all()
+            raise OperationalError('CREATE TABLE files', {}, Exception('table files already exists'))
+        create_all(*args, **kwargs)
+        calls.append(sorted(inspect(db.engine).get_table_names()))
+
+    monkeypatch.setattr(db, 'create_all', racing_create_all)
+    assert bootstrap_db()
+    warm_up_database()
+    assert calls[-1] == sorted(db.metadata.tables)
+    assert len(calls) == 3
+
+    def always_racing_create_all(*args, **kwargs):
+        raise OperationalError('CREATE TABLE files', {}, Exception('table files already exists'))
+
+    monkeypatch.setattr(db, 'create_all', always_racing_create_all)
+    assert not bootstrap_db()
+
+    def broken_create_all(*args, **kwargs):
+        raise OperationalError('CREATE TABLE files', {}, Exception('Access denied'))
+
+    monkeypatch.setattr(db, 'create_all', broken_create_all)
+    assert not bootstrap_db()
+
+def test_upgrade_schema_brings_baseline_tables_up_to_date(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    with engine.begin() as connection:
+        # The tables as the first release created them
+        connection.execute(text('CREATE TABLE "healthCheck" (check_id INTEGER PRIMARY KEY, created_at DATETIME)'))
+        connection.execute(text(
+            'CREATE TABLE files (id VARCHAR(36) PRIMARY KEY, file_name VARCHAR(255) NOT NULL, '
+            'url VARCHAR(512) NOT NULL, upload_date DATE)'
+        ))
+        connection.execute(text("INSERT INTO files VALUES ('old', 'a.txt', 'test-bucket/old/a.txt', '2024-01-01')"))
+
+    assert len(upgrade_schema(engine)) == 8
+    assert upgrade_schema(engine) == []
+    db.metadata.create_all(engine)
+    with engine.connect() as connection:
+        row = connection.execute(File.__table__.select()).one()
+        assert row.id == 'old' and row.deleted_at is None
+    indexes = {index['name'] for index in inspect(engine).get_indexes('files')}
+    assert {'ix_files_upload_date_id', 'ix_files_deleted_at_id', 'ix_files_content_sha256'} <= indexes
+    assert inspect(engine).get_indexes('healthCheck')[0]['column_names'] == ['created_at']
+    engine.dispose()
+
+def test_concurrency_limiter_queues_then_sheds():
+    limiter = ConcurrencyLimiter('test')
+    assert limiter.acquire(1, 1, 0) == (True, None, 0.0)
+    assert limiter.acquire(1, 0, 0)[:2] == (False, 'queue_full')
+    assert limiter.acquire(1, 1, 0.01)[:2] == (False, 'timeout')
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(1, 1, 5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    assert limiter.acquire(1, 1, 0)[:2] == (False, 'queue_full')
+    limiter.release()
+    waiter.join()
+    assert results[0][0] is True and results[0][2] > 0
+    assert limiter.active == 1
+
+def test_admission_control_sheds_uploads_but_not_reads(client, s3, monkeypatch):
+    stats = RecordingStats()
+    monkeypatch.setattr('app.statsd_client', stats)
+    monkeypatch.setitem(app.config['ADMISSION_LIMITS'], 'upload', 1)
+    monkeypatch.setitem(app.config, 'ADMISSION_QUEUE_SIZE', 0)
+    limiter = get_admission_limiter('upload')
+    assert limiter.acquire(1, 0, 0)[0]
+
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app.config['ADMISSION_RETRY_AFTER'])
+    assert s3.objects == {}
+    assert 'admission.upload.rejected.queue_full' in stats.names()
+    assert client.get('/healthz').status_code == 200
+    assert client.get('/v1/file/unknown-id').status_code == 400
+
+    limiter.release()
+    response = client.post('/v2/file', data={'file': (io.BytesIO(b'data'), 'a.txt')})
+    assert response.status_code == 201
+    response.close()
+    assert limiter.active == 0
+
+def test_admission_slot_held_until_stream_closes(client, s3, monkeypatch):
+    file_id = upload_content(client, b'x' * 1024)
+    monkeypatch.setitem(app.config['ADMISSION_LIMITS'], 'read', 1)
+    limiter = get_admission_limiter('read')
+
+    response = client.get(f'/v1/file/{file_id}/content', buffered=False)
+    assert limiter.active == 1
+    assert response.get_data() == b'x' * 1024
+    response.close()
+    assert limiter.active == 0
+
+def test_async_delete_tombstones_until_reaped(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_DELETE_ASYNC', True)
+    kept = upload_content(client, b'kept', 'kept.txt')
+    file_ids = [upload_content(client, f'gone {n}'.encode(), f'gone-{n}.txt') for n in range(3)]
+
+    assert client.delete(f'/v1/file/{file_ids[0]}').status_code == 204
+    response = client.post('/v1/files/delete', json={'ids': file_ids[1:] + ['unknown-id']})
+    assert [result['status'] for result in response.get_json()['results']] == ['deleted', 'deleted', 'not_found']
+    assert len(s3.objects) == 4
+
+    assert client.get(f'/v1/file/{file_ids[0]}').status_code == 400
+    assert client.get(f'/v1/file/{file_ids[1]}/content').status_code == 404
+    assert client.delete(f'/v1/file/{file_ids[0]}').status_code == 404
+    assert [file['id'] for file in client.get('/v1/files').get_json()['files']] == [kept]
+    lookup = client.post('/v1/files/lookup', json={'ids': file_ids}).get_json()
+    assert lookup['files'] == [] and lookup['missing'] == file_ids
+
+    with app.app_context():
+        assert reap_deleted_files(batch_size=2) == (3, 0)
+        assert [file.id for file in File.query.all()] == [kept]
+    assert len(s3.objects) == 1
+
+def test_reapers_skip_batches_claimed_by_another_worker(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_DELETE_ASYNC', True)
+    file_ids = [upload_content(client, f'gone {n}'.encode(), f'gone-{n}.txt') for n in range(4)]
+    response = client.post('/v1/files/delete', json={'ids': file_ids})
+    assert all(result['status'] == 'deleted' for result in response.get_json()['results'])
+
+    with app.app_context():
+        # Another worker holds the two oldest tombstones while it deletes their objects
+        claimed = [row.id for row in claim_tombstoned_files(2, None)]
+        assert reap_deleted_files(batch_size=10) == (2, 0)
+        assert s3.call_count('delete_objects') == 1
+        assert sorted(file.id for file in File.query.all()) == sorted(claimed)
+
+        # A lease left behind by a crashed worker runs out
+        File.query.update({File.reap_claimed_until: datetime.now() - timedelta(seconds=1)})
+        db.session.commit()
+        assert reap_deleted_files(batch_size=10) == (2, 0)
+    assert s3.objects == {}
+
+def test_reaper_retries_failed_objects_with_backoff(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'FILE_DELETE_ASYNC', True)
+    monkeypatch.setitem(app.config, 'FILE_REAPER_INTERVAL', 10)
+    monkeypatch.setattr('app.file_reaper', FileReaper())
+    file_id = upload_content(client, b'stuck', 'stuck.txt')
+    s3.fail_delete_keys.add(f'{file_id}/stuck.txt')
+    assert client.delete(f'/v1/file/{file_id}').status_code == 204
+
+    with app.app_context():
+        assert app_module.file_reaper.run() == (0, 1)
+        assert app_module.file_reaper.failures == 1
+        assert app_module.file_reaper.run() is None
+
+        s3.fail_delete_keys.clear()
+        app_module.file_reaper.next_run = 0.0
+        assert app_module.file_reaper.run() == (1, 0)
+        assert app_module.file_reaper.failures == 0
+        assert File.query.count() == 0
+    assert s3.objects == {}
+
+def test_reaper_releases_deduplicated_blobs(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    monkeypatch.setitem(app.config, 'FILE_DELETE_ASYNC', True)
+    first = upload_content(client, b'shared content', 'a.txt')
+    second = upload_content(client, b'shared content', 'b.txt')
+    assert len(s3.objects) == 1
+
+    assert client.delete(f'/v1/file/{first}').status_code == 204
+    with app.app_context():
+        assert reap_deleted_files(batch_size=10) == (1, 0)
+        assert Blob.query.one().ref_count == 1
+    assert len(s3.objects) == 1
+
+    assert client.delete(f'/v1/file/{second}').status_code == 204
+    with app.app_context():
+        assert reap_deleted_files(batch_size=10) == (1, 0)
+        assert Blob.query.count() == 0
+    assert s3.objects == {}
+
+CSV_CONTENT = b''.join(b'%d,sensor-%d,%d.5,ok\n' % (n, n % 7, n * 3) for n in range(5000))
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_compressible_upload_is_stored_gzipped(client, s3, monkeypatch, streaming):
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESSION', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_STREAMING', streaming)
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESS_SAMPLE_SIZE', 4096)
+    file_id = upload_content(client, CSV_CONTENT, 'readings.csv')
+
+    stored = s3.objects[('test-bucket', f'{file_id}/readings.csv')]
+    assert stored['ContentEncoding'] == 'gzip'
+    assert stored['ContentType'] == 'text/csv'
+    assert gzip.decompress(stored['Body']) == CSV_CONTENT
+    assert len(stored['Body']) < len(CSV_CONTENT) / 2
+    with app.app_context():
+        assert db.session.get(File, file_id).content_encoding == 'gzip'
+
+def test_incompressible_and_small_uploads_are_stored_as_received(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESSION', True)
+    noise = random.Random(1).randbytes(32 * 1024)
+    noise_id = upload_content(client, noise, 'noise.bin')
+    small_id = upload_content(client, b'a,b\n1,2\n', 'small.csv')
+    # Low-entropy content is compressed even without a recognised type
+    zeros_id = upload_content(client, bytes(32 * 1024), 'zeros.bin')
+
+    assert s3.objects[('test-bucket', f'{noise_id}/noise.bin')]['Body'] == noise
+    assert s3.objects[('test-bucket', f'{small_id}/small.csv')]['ContentEncoding'] is None
+    assert s3.objects[('test-bucket', f'{zeros_id}/zeros.bin')]['ContentEncoding'] == 'gzip'
+    with app.app_context():
+        assert db.session.get(File, noise_id).content_encoding is None
+
+def test_compressed_download_follows_accept_encoding(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESSION', True)
+    monkeypatch.setitem(app.config, 'DOWNLOAD_CHUNK_SIZE', 1024)
+    file_id = upload_content(client, CSV_CONTENT, 'readings.csv')
+    stored = s3.objects[('test-bucket', f'{file_id}/readings.csv')]
+
+    response = client.get(f'/v1/file/{file_id}/content', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.get_data() == stored['Body']
+
+    response = client.get(f'/v1/file/{file_id}/content', buffered=False)
+    assert 'Content-Encoding' not in response.headers and 'Content-Length' not in response.headers
+    assert all(len(chunk) <= 1024 for chunk in response.response)
+    response.close()
+    response = client.get(f'/v1/file/{file_id}/content', headers={'Range': 'bytes=0-9'})
+    assert response.status_code == 200
+    assert response.get_data() == CSV_CONTENT
+    weak_etag = response.headers['ETag']
+    assert weak_etag == f"W/{stored['ETag']}"
+
+    response = client.get(f'/v1/file/{file_id}/content', headers={'If-None-Match': weak_etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == weak_etag
+
+def test_deduplicated_upload_takes_encoding_of_stored_blob(client, s3, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESSION', True)
+    monkeypatch.setitem(app.config, 'UPLOAD_DEDUP', True)
+    first = upload_content(client, CSV_CONTENT, 'readings.csv')
+    monkeypatch.setitem(app.config, 'UPLOAD_COMPRESSION', False)
+    second = upload_content(client, CSV_CONTENT, 'copy.csv')
+
+    assert len(s3.objects) == 1
+    with app.app_context():
+        assert db.session.get(File, second).content_encoding == 'gzip'
+        assert Blob.query.one().content_encoding == 'gzip'
+    response = client.get(f'/v1/file/{second}/content')
+    assert response.get_data() == CSV_CONTENT
+    assert client.get(f'/v1/file/{first}/content').get_data() == CSV_CONTENT